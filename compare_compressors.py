@@ -12,15 +12,17 @@ Tests various HTTP header compression algorithms, to compare them.
 
 # pylint: disable=W0311
 
-from collections import defaultdict
 from importlib import import_module
+import json
 import locale
 import optparse
-import operator
-from functools import reduce
 
-from lib.harfile import read_har_file
+from lib.checkpoint import Checkpoint
+from lib.corpus import Corpus
+from lib.pipeline import Pipeline
 from lib.processors import Processors
+from lib.results import ResultsWriter
+from lib.stream import StreamTotals
 
 
 class CompressionTester(object):
@@ -39,8 +41,11 @@ class CompressionTester(object):
       new_processor_names.extend(self.options.processor_names)
       self.options.processor_names = new_processor_names
     self.output = output
-    self.tsv_out = defaultdict(list)  # accumulator for TSV output
-    self.processors = Processors(self.options, self.msg_types, output)
+    self.corpus = Corpus()
+    if self.options.pipeline:
+      self.processors = Pipeline(self.options, self.msg_types, output)
+    else:
+      self.processors = Processors(self.options, self.msg_types, output)
     self.streamify = self.load_streamifier(self.options.streamifier)
     self.run()
 
@@ -48,39 +53,100 @@ class CompressionTester(object):
     "Let's do this thing."
     sessions = []
     for filename in self.args:
-      har_requests, har_responses = read_har_file(filename)
-      messages = list(zip(har_requests, har_responses))
+      messages = self.corpus.read_file(filename, self.options.input_format)
       sessions.extend(self.streamify(messages))
-    for session in sessions:
+    procs = self.processors.names()
+    totals = dict((msg_type, StreamTotals("TOTAL", msg_type, procs))
+                  for msg_type in self.msg_types)
+    writer = None
+    if self.options.tsv or self.options.ndjson:
+      counts = dict((msg_type, 0) for msg_type in self.msg_types)
+      for session in sessions:
+        counts[session.msg_type] += len(session.messages)
+      writer = ResultsWriter(self.options.prefix, self.msg_types, procs,
+                             self.options.tsv, self.options.ndjson, counts)
+    checkpoint = None
+    if self.options.checkpoint or self.options.resume:
+      checkpoint = Checkpoint(self.options.checkpoint or
+                              "%scheckpoint.ndjson" % self.options.prefix,
+                              self.options)
+    # Sessions are let go of as soon as they're done with, so that only
+    # the totals build up.
+    sessions.reverse()
+    while sessions:
+      session = sessions.pop()
       if self.options.verbose > 0:
         session.print_header(self.output)
-      self.processors.process_session(session)
+      if checkpoint:
+        key = checkpoint.next_key(session)
+      if checkpoint and checkpoint.restore(session, key):
+        if self.options.verbose > 0:
+          self.output("  (from checkpoint)\n")
+        if self.options.fields:
+          self.processors.add_field_sizes(session.msg_type,
+                                          session.field_sizes)
+      else:
+        self.processors.process_session(session)
+        if checkpoint:
+          checkpoint.save(session, key)
       if self.options.verbose > 0:
         session.print_summary(self.output, self.options.baseline)
+      totals[session.msg_type].add(session)
+      if writer:
+        writer.write(session)
     self.processors.done()
+    if checkpoint:
+      checkpoint.close()
+    if writer:
+      writer.close()
     for msg_type in self.msg_types:
-      ttl_stream = reduce(operator.add, [s for s in sessions if s.msg_type == msg_type])
-      ttl_stream.name = "TOTAL"
-      ttl_stream.print_header(self.output)
-      ttl_stream.print_summary(self.output, self.options.baseline)
-    if self.options.tsv:
-      out = {}
-      for msg_type in self.msg_types:
-        out[msg_type] = [
-          open("%s%s" % (self.options.prefix, "%s.tsv" % msg_type), 'w'),
-          0
-        ]
-        sessions[0].print_tsv_header(out[msg_type][0].write)
-      for session in sessions:
-        tsvfh, tsv_count = out[session.msg_type]
-        out[session.msg_type][1] = session.print_tsv(tsvfh.write, tsv_count)
-      for fh, count in list(out.values()):
-        fh.close()
+      totals[msg_type].print_header(self.output)
+      totals[msg_type].print_summary(self.output, self.options.baseline)
+    if self.options.fields:
+      self.write_field_sizes()
+
+  def write_field_sizes(self):
+    """
+    Write the bytes each codec spent on each header field, and their ratio
+    to the baseline's, as TSV and JSON. Fields are sorted by baseline size.
+    """
+    procs = self.processors.names()
+    baseline = self.options.baseline
+    out = {}
+    tsvfh = open("%sfields.tsv" % self.options.prefix, 'w')
+    tsvfh.write("\t".join(["type", "name"] + procs +
+                          ["%s ratio" % proc for proc in procs]))
+    tsvfh.write("\n")
+    for msg_type in self.msg_types:
+      field_sizes = self.processors.field_sizes[msg_type]
+      out[msg_type] = {}
+      for name in sorted(field_sizes,
+                         key=lambda n: (-field_sizes[n].get(baseline, 0), n)):
+        sizes = field_sizes[name]
+        base_size = sizes.get(baseline)
+        fields = {}
+        for proc in procs:
+          if proc in sizes:
+            ratio = 1.0 * sizes[proc] / base_size if base_size else None
+            fields[proc] = {'size': sizes[proc], 'ratio': ratio}
+        out[msg_type][name] = fields
+        line = [msg_type, name]
+        line.extend([str(sizes[proc]) if proc in fields else ""
+                     for proc in procs])
+        line.extend(["%.3f" % fields[proc]['ratio']
+                     if proc in fields and fields[proc]['ratio'] is not None
+                     else "" for proc in procs])
+        tsvfh.write("\t".join(line))
+        tsvfh.write("\n")
+    tsvfh.close()
+    jsonfh = open("%sfields.json" % self.options.prefix, 'w')
+    json.dump(out, jsonfh, indent=1, sort_keys=True)
+    jsonfh.close()
 
   def load_streamifier(self, name):
     "Load the streamifier specified in the options."
     return import_module("%s.%s" % (self.streamifier_dir, name)) \
-      .Streamifier([p.name for p in self.processors.processors['req']]) \
+      .Streamifier(self.processors.names()) \
       .streamify
 
   def parse_options(self):
@@ -115,15 +181,55 @@ class CompressionTester(object):
                   dest="tsv",
                   help="output TSV.",
                   default=False)
+    optp.add_option('--ndjson',
+                  action="store_true",
+                  dest="ndjson",
+                  help="output each message's sizes and times as "
+                  "newline-delimited JSON.",
+                  default=False)
+    optp.add_option('-p', '--pipeline',
+                  action="store_true",
+                  dest="pipeline",
+                  help="run each codec in its own worker process, at the "
+                  "same time.",
+                  default=False)
     optp.add_option('-s', '--streamifier',
                   dest="streamifier",
                   help="streamifier module to use (default: %default).",
                   default="public_suffix")
+    optp.add_option('--format',
+                  dest="input_format",
+                  type="choice",
+                  choices=["har", "jsonl"],
+                  help="format of the input files; 'har', or 'jsonl' for "
+                  "JSON Lines with a HAR entry per line. Files ending in .gz "
+                  "or .zst are decompressed. (default: from the file name)",
+                  default=None)
     optp.add_option('--prefix',
                   action="store",
                   dest="prefix",
                   help="Prefix for TSV file output.",
                   default="")
+    optp.add_option('--checkpoint',
+                  dest="checkpoint",
+                  help="record the results of each session in FILE as it's "
+                  "finished. (default with --resume: "
+                  "<prefix>checkpoint.ndjson)",
+                  default=None,
+                  metavar='FILE')
+    optp.add_option('--resume',
+                  action="store_true",
+                  dest="resume",
+                  help="skip sessions whose results have already been "
+                  "recorded for every codec by --checkpoint, and carry on "
+                  "recording.",
+                  default=False)
+    optp.add_option('-f', '--fields',
+                  action="store_true",
+                  dest="fields",
+                  help="output bytes per header field for each codec that "
+                  "reports them, as fields.tsv and fields.json.",
+                  default=False)
     return optp.parse_args()
 
 
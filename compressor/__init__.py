@@ -6,6 +6,8 @@ Base class and common functions for compressor implementations.
 
 # pylint: disable=W0311
 
+import zlib
+
 class BaseProcessor(object):
   "Base class for compression processors."
   def __init__(self, options, is_request, params):
@@ -17,13 +19,24 @@ class BaseProcessor(object):
     else:
       self.name = name
     self.params = params
+    # header name -> bytes of output; None unless field attribution is on.
+    self.field_sizes = {} if getattr(options, 'fields', False) else None
+
+  def record_field(self, name, size):
+    """
+    Attribute 'size' bytes of compressed output to the header field 'name'.
+    Codecs that can tell which bytes belong to which field should call this
+    when self.field_sizes is not None.
+    """
+    self.field_sizes[name] = self.field_sizes.get(name, 0) + size
 
   def compress(self, in_headers, host):
     """
     'in_headers' are the headers that will be processed. They are expected
     to be a dictionary whose keys are header names (all lowercase), and
     whose values are strings. Multiple instances of a header field will
-    be delimited by \0 (null) characters.
+    be delimited by \0 (null) characters. The same dictionary is given to
+    every processor, so it must not be changed.
     
     There are a number of special header names, indicated by ':' as the
     first character in the name.
@@ -44,30 +57,97 @@ class BaseProcessor(object):
     raise NotImplementedError
     
     
+class SharedHeaders(dict):
+  """
+  A header dictionary that is handed to every processor for the same
+  message, and so must not be changed. format_http1 keeps its plain HTTP/1
+  serialisation in 'http1', so that it is only made once.
+  """
+  http1 = None
+
+
+# Primed zlib (compressor, decompressor) pairs, by parameters and dictionary
+_zlib_templates = {}
+
+def _zlib_template(level, wbits, mem_level, strategy, dictionary):
+  key = (level, wbits, mem_level, strategy, dictionary)
+  if key not in _zlib_templates:
+    compressor = zlib.compressobj(level, zlib.DEFLATED, wbits, mem_level,
+                                  strategy)
+    decompressor = zlib.decompressobj()
+    if dictionary:
+      data = compressor.compress(dictionary)
+      data += compressor.flush(zlib.Z_SYNC_FLUSH)
+      decompressor.decompress(data)
+    _zlib_templates[key] = (compressor, decompressor)
+  return _zlib_templates[key]
+
+
+def primed_compressor(level=zlib.Z_DEFAULT_COMPRESSION,
+                      wbits=15,
+                      mem_level=8,
+                      strategy=zlib.Z_DEFAULT_STRATEGY,
+                      dictionary=None):
+  """
+  Return a zlib compressor that has already compressed (and sync-flushed)
+  dictionary, if given. Primed contexts are cached; each call returns a
+  copy, so priming only happens once per set of parameters.
+  """
+  return _zlib_template(level, wbits, mem_level, strategy, dictionary)[0] \
+    .copy()
+
+
+def primed_decompressor(level=zlib.Z_DEFAULT_COMPRESSION,
+                        wbits=15,
+                        mem_level=8,
+                        strategy=zlib.Z_DEFAULT_STRATEGY,
+                        dictionary=None):
+  """
+  Return a zlib decompressor matching primed_compressor() called with the
+  same arguments; i.e., it has already decompressed the primed dictionary.
+  """
+  return _zlib_template(level, wbits, mem_level, strategy, dictionary)[1] \
+    .copy()
+
+
 def format_http1(frame, 
                  delimiter="\r\n", 
                  valsep=": ", 
                  host='host', 
-                 version="HTTP/1.1"):
-  """Take the frame and format it as HTTP/1-ish"""
+                 version="HTTP/1.1",
+                 record_field=None):
+  """
+  Take the frame and format it as HTTP/1-ish. If given, record_field is
+  called with the name and size of each header field's share of the output.
+  """
+  shared = type(frame) is SharedHeaders and record_field is None and \
+    (delimiter, valsep, host, version) == ("\r\n", ": ", 'host', "HTTP/1.1")
+  if shared and frame.http1 is not None:
+    return frame.http1
   out_frame = []
   top_line = ''
   avoid_list = []
   if ':method' in frame:
-    top_line = '%s %s %s%s' % (
-        frame.get(':method',""), frame.get(':path', ""),
-        frame.get(':version', version), delimiter)
-    avoid_list = [':method', ':path', ':version']
+    top_fields = [(':method', frame.get(':method',"")),
+                  (':path', frame.get(':path', "")),
+                  (':version', frame.get(':version', version))]
   else:
-    top_line = '%s %s %s%s' % (
-        frame.get(':version', version), frame.get(':status',""),
-        frame.get(':status-text', '?'), delimiter)
-    avoid_list = [':version', ':status', ':status-text']
+    top_fields = [(':version', frame.get(':version', version)),
+                  (':status', frame.get(':status',"")),
+                  (':status-text', frame.get(':status-text', '?'))]
+  top_line = '%s %s %s%s' % (
+      top_fields[0][1], top_fields[1][1], top_fields[2][1], delimiter)
+  avoid_list = [key for (key, val) in top_fields]
   out_frame.append(top_line)
+  if record_field:
+    for (key, val) in top_fields[:2]:
+      record_field(key, len(val) + 1)
+    record_field(top_fields[2][0], len(top_fields[2][1]) + len(delimiter))
   
   for (key, val) in frame.items():
     if key in avoid_list:
       continue
+    field = key
     if key == ':host':
       key = host
     for individual_val in val.split('\x00'):
@@ -75,7 +155,13 @@ def format_http1(frame,
       out_frame.append(valsep)
       out_frame.append(individual_val)
       out_frame.append(delimiter)
+      if record_field:
+        record_field(field, len(key) + len(valsep) + len(individual_val) +
+                            len(delimiter))
   out_frame.append(delimiter)
+  if shared:
+    frame.http1 = ''.join(out_frame)
+    return frame.http1
   return ''.join(out_frame)
   
   
@@ -2,21 +2,26 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
-import zlib
-import re
+import binascii
+from collections import OrderedDict
 import bohe
-import struct
 import header_freq_tables
-import common_utils
 
 from huffman import Huffman
 from .. import BaseProcessor
-from bit_bucket import BitBucket
 
 
 # There are a number of TODOS in the spdy4
 #      have near indices. Possibly renumber whever something is referenced)
 
+# Registered header name -> the id it is sent as.
+ID_INDEX = {}
+for i, k in enumerate(bohe.ID_TABLE):
+  ID_INDEX.setdefault(k, i + 1)
+
+# How many Huffman-coded values each Processor remembers.
+HUFF_CACHE_SIZE = 4096
+
 class Processor(BaseProcessor):
 
   headers = []
@@ -24,55 +29,82 @@ class Processor(BaseProcessor):
   def __init__(self, options, is_request, params):
     BaseProcessor.__init__(self, options, is_request, params)
     if is_request:
-      self.huff = huffman.Huffman(header_freq_tables.request_freq_table)
+      self.huff = Huffman(header_freq_tables.request_freq_table)
     else:
-      self.huff = huffman.Huffman(header_freq_tables.response_freq_table)
+      self.huff = Huffman(header_freq_tables.response_freq_table)
+    # The code table as (code, length in bits) pairs, codes as plain ints.
+    self.codes = []
+    for code_bytes, code_bits in self.huff.code_table:
+      code = 0
+      for b in code_bytes:
+        code = code << 8 | b
+      self.codes.append((code >> (len(code_bytes) * 8 - code_bits), code_bits))
+    self.huff_cache = OrderedDict()
 
   def compress(self, inp_headers, host):
-    data = BitBucket()
-    res = ''
+    # Each header record (flags, lengths and value) is packed into one int,
+    # and the records into another, which becomes bytes once at the end. The
+    # result is bit-for-bit what storing each field in a BitBucket gave.
+    frame = 0
+    frame_bits = 0
     for k,v in inp_headers.items():
-      if k in bohe.ID_TABLE:
-        zz = data.NumBits()
+      # Set the multiple values flag...
+      multiple = '\u00' in v and 1 or 0
+      header_id = ID_INDEX.get(k)
+      if header_id is not None:
         # encode as registered header
-        data.StoreBits8(bohe.ID_TABLE.index(k) + 1)
-        l = 0
-        dohuff = True
-        # Set the binary flag
         if k in bohe.ENCODERS:
-          data.StoreBit(1)
-          dohuff = False
-        # Set the multiple values flag...
-        if '\u00' in v:
-          data.StoreBit(1)
-        else:
-          data.StoreBit(0)
-        val = bohe.encode(k,v)
-        if dohuff:
-          val_as_list, len_in_bits = self.do_huff(self.huff, val)
+          # ... after the binary flag
+          record = header_id << 2 | 2 | multiple
+          record_bits = 10
+          value, value_bits = self.str_bits(bohe.encode(k, v))
         else:
-          val_as_list = common_utils.StrToList(val)
-          len_in_bits = len(val_as_list) *8
-        data.StoreBits22(len(val_as_list))
-        data.StoreBits( (val_as_list, len_in_bits) )
+          record = header_id << 1 | multiple
+          record_bits = 9
+          value, value_bits = self.do_huff(v)
       else:
-        data.StoreBits8(128 | len(k))
-        data.StoreBits((common_utils.StrToList(k), len(k)*8))
-        data.StoreBit(0) # assume not binary value for now
-        if '\u00' in v:
-          data.StoreBit(1)
-        else:
-          data.StoreBit(0)
-        val_as_list, len_in_bits = self.do_huff(self.huff, v)
-        data.StoreBits22(len(val_as_list))
-        data.StoreBits((val_as_list, len_in_bits))
-    return ''.join(common_utils.ListToStr(data.GetAllBits()[0]))
+        name, name_bits = self.str_bits(k)
+        # assume not binary value for now
+        record = ((128 | len(k)) << name_bits | name) << 2 | multiple
+        record_bits = 10 + name_bits
+        value, value_bits = self.do_huff(v)
+      # The byte length used to be stored with BitBucket.StoreBits22, which
+      # actually stores the top 30 of the 32 bits it is given; keep that.
+      record = (record << 30 | ((value_bits + 7) >> 3) >> 2) << value_bits \
+        | value
+      record_bits += 30 + value_bits
+      frame = frame << record_bits | record
+      frame_bits += record_bits
+    if not frame_bits:
+      return ''
+    pad = -frame_bits % 8
+    return binascii.unhexlify('%0*x' % ((frame_bits + pad) / 4, frame << pad))
+
+  def str_bits(self, val):
+    "Return the bytes of val as an int, and how many bits that is."
+    if not val:
+      return 0, 0
+    return int(binascii.hexlify(val), 16), len(val) * 8
 
-  def do_huff(self, huff, val):
-    val_as_list = common_utils.StrToList(val)
-    (val_as_list, len_in_bits) = huff.Encode(val_as_list, True)
-    #len_in_bits = len(val_as_list) *8
-    return val_as_list, len_in_bits
+  def do_huff(self, val):
+    "Return the Huffman coding of val (with EOF) as an int, and its bits."
+    cache = self.huff_cache
+    try:
+      coded = cache.pop(val)
+    except KeyError:
+      codes = self.codes
+      value = 0
+      value_bits = 0
+      for c in map(ord, val):
+        code, code_bits = codes[c]
+        value = value << code_bits | code
+        value_bits += code_bits
+      code, code_bits = codes[256]
+      coded = (value << code_bits | code, value_bits + code_bits)
+      if len(cache) >= HUFF_CACHE_SIZE:
+        cache.popitem(last=False)
+    cache[val] = coded
+    return coded
     
 
 # NO DECOMPRESSION YET!
@@ -2,6 +2,7 @@
 Provides binary encoders for various http header value types
 """
 
+from collections import OrderedDict
 from datetime import datetime
 from Cookie import BaseCookie
 from werkzeug import http
@@ -10,6 +11,26 @@ import struct
 import md5
 import re
 
+# Caches the results of a value encoder for the maxsize (value, type) pairs
+# it was most recently called with; header values repeat a lot in a session.
+def memoized(maxsize=1024):
+  def decorate(func):
+    cache = OrderedDict()
+    def encoder(val, typ='req'):
+      key = (val, typ)
+      try:
+        encoded = cache.pop(key)
+      except KeyError:
+        encoded = func(val, typ)
+        if len(cache) >= maxsize:
+          cache.popitem(last=False)
+      cache[key] = encoded
+      return encoded
+    encoder.__name__ = func.__name__
+    encoder.cache = cache
+    return encoder
+  return decorate
+
 # Returns the given datetime as UNIX Epoch...
 def epoch(dt):
   return (dt - datetime.utcfromtimestamp(0)).total_seconds()
@@ -17,10 +38,29 @@ def epoch(dt):
 # Our "New Epoch"... used as the basis for compact date encoding
 NEW_EPOCH = epoch(datetime(1990,1,1,0,0,0,0))
     
+MONTHS = dict((m, i + 1) for i, m in enumerate(
+  ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+   'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']))
+
+# The fixed RFC 1123 format that nearly all dates use; anything else goes
+# through strptime.
+RFC1123_DATE = re.compile(
+  r'(?:Mon|Tue|Wed|Thu|Fri|Sat|Sun), (\d\d) (%s) (\d{4}) (\d\d):(\d\d):(\d\d) GMT$'
+  % '|'.join(MONTHS))
+
+def parse_date(val):
+  match = RFC1123_DATE.match(val)
+  if match:
+    day, month, year, hour, minute, second = match.groups()
+    return datetime(int(year), MONTHS[month], int(day),
+                    int(hour), int(minute), int(second))
+  return datetime.strptime(val, '%a, %d %b %Y %H:%M:%S GMT')
+
 # Optimized date encoding based on NEW_EPOCH value
+@memoized()
 def enc_date(val, typ='req'):
   try:
-    return enc_uvarint(epoch(datetime.strptime(val, '%a, %d %b %Y %H:%M:%S GMT')) - NEW_EPOCH)
+    return enc_uvarint(epoch(parse_date(val)) - NEW_EPOCH)
   except:
     # parse it as delta-seconds... at least try 
     try:
@@ -51,6 +91,7 @@ def enc_uvarint(val, typ='req'):
   return v
   
 # Encoding a Set-Cookie header value.. basic encoding (no extensions supported beyond HttpOnly and Secure)
+@memoized()
 def enc_setcookie(val, typ='req'):
   vals = val.split('\x00');
   encoded = ''
@@ -79,6 +120,7 @@ def enc_setcookie(val, typ='req'):
         encoded += enc_date(morsel['expires'])
   return encoded
   
+@memoized()
 def enc_cookie(val, type='req'):
   val = http.parse_dict_header(val)
   _v = ''
@@ -114,6 +156,7 @@ def valOrZero(parts,m):
   else: 
     return 0
 
+@memoized()
 def enc_cachecontrol(val, typ='req'):
   parts = _parse_cache_control(val)
   encoded = '_'; #represent first flags bit.. easier this way since we're just measuring space right now, TODO: Fix this
@@ -151,6 +194,7 @@ def enc_method(val, type='req'):
 
 # Encode accept headers... this is LOSSY! Q-values are dropped,
 # values are sorted in order of preference. TODO: Investigate lossless alternatives
+@memoized()
 def enc_accept(val, type='req'):
   vals = http.parse_accept_header(val)
   _v = ''
@@ -163,6 +207,7 @@ def enc_accept(val, type='req'):
   
 # For experimentation, encodes etags as 16-byte md5 of the original etag.. in binary
 # lists of etags are encoded as [num_tags]*[[len][tag]]
+@memoized()
 def enc_etag(val, type='req'):
   vals = val.split('\x00')
   _v = ''
@@ -187,6 +232,7 @@ p3p_table = ['NOI','ALL','CAO','IDC',
 'STA','POL','HEA','PRE',
 'LOC','GOV','OTC','TST']
 
+@memoized()
 def enc_p3p(val, type='req'):
   val = http.parse_dict_header(val)
   _v = ''
@@ -212,12 +258,15 @@ def enc_p3p(val, type='req'):
     _v += cp
   return _v
 
+HEX_VALUE = re.compile(r"^([a-fA-F0-9]{2})*$")
+BASE64_VALUE = re.compile(r"^(?:[A-Za-z0-9+/]{4})*(?:[A-Za-z0-9+/]{2}==|[A-Za-z0-9+/]{3}=)?$")
+
 def attempt_decode(value):
   if value is None:
     return value
-  if re.match(r"^([a-fA-F0-9]{2})*$", value):
+  if HEX_VALUE.match(value):
     return value.decode('hex_codec')
-  elif re.match(r"^(?:[A-Za-z0-9+/]{4})*(?:[A-Za-z0-9+/]{2}==|[A-Za-z0-9+/]{3}=)?$", value):
+  elif BASE64_VALUE.match(value):
     return value.decode('base64_codec')
   else:
     return value
@@ -251,6 +300,14 @@ def encode(key,val):
   else: 
     return val
 
+# Encode a number of values of the same header at once
+def encode_many(key, vals):
+  if key in ENCODERS:
+    encoder = ENCODERS[key]
+    return [encoder(val) for val in vals]
+  else:
+    return list(vals)
+
 
 ID_TABLE = [
   ':path', 
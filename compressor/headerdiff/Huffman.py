@@ -104,97 +104,136 @@ def normalize_stats(stats):
   """Normalize frequency statistics."""
   return dict((chr(k) if k < 256 else k, v if v else 1) for k, v in stats.items())
 
-class BitEncoder(object):
-  """Class for writing group of bits to a string."""
-  def __init__(self):
-    self.reset()
-  
-  def reset(self):
-    self.bytes = ""
-    self.current = 0x00
-    self.free = 8
-    
-  def push_bits(self, value, count):
-    while count:
-      if self.free <= count:
-        c = (self.current << self.free) + ((value >> (count - self.free)) & (0xFF >> (8 - self.free)))
-        self.bytes += chr(c)
-        count -= self.free
-        self.current = 0x00
-        self.free = 8
-      else:
-        self.current = (self.current << count) + (value & (0xFF >> (8 - count)))
-        self.free -= count
-        count = 0
-  
-  def code(self):
-    if self.free < 8:
-      c = self.current << self.free
-      self.bytes += chr(c)
-    return self.bytes
+EOS = 256
+# Decoding state reached once EOS has been decoded
+EOS_STATE = -1
+
+def canonical_codes(lengths):
+  """Assign canonical codes to symbols, given their code lengths."""
+  codes = {}
+  code = 0
+  previous = 0
+  for length, symbol in sorted((l, s) for s, l in lengths.items()):
+    code <<= length - previous
+    codes[symbol] = code
+    code += 1
+    previous = length
+  return codes
 
-class BitDecoder(object):
-  """Class for reading bits one by one from a string."""
-  masks = [
-    0x80, 0x40, 0x20, 0x10, 0x08, 0x04, 0x02, 0x01
-    ]
-  def __init__(self, code=None):
-    self.reset(code)
+def decoding_tables(codes, lengths):
+  """
+  Build the byte-oriented decoding tables for a canonical code.
   
-  def reset(self, code):
-    self.code = code
-    self.index = 0
-    self.current = 0
-    self.bit = 8
+  Decoding states are the internal nodes of the code tree, 0 being the
+  root. For a state and an input byte, entry (state << 8) | byte of the
+  tables gives the state reached after the 8 bits of the byte, and the
+  symbols decoded on the way (EOS_STATE if EOS was decoded: any following
+  bits are padding).
+  The tables are built on nibbles first, then combined into bytes.
+  """
+  # Code tree: children[2 * node + bit] is either a node, or ~symbol
+  children = [None, None]
+  for symbol, code in codes.items():
+    node = 0
+    for i in range(lengths[symbol] - 1, 0, -1):
+      bit = (code >> i) & 1
+      if children[2 * node + bit] is None:
+        children[2 * node + bit] = len(children) // 2
+        children.extend([None, None])
+      node = children[2 * node + bit]
+    children[2 * node + (code & 1)] = ~symbol
   
-  def next_bit(self):
-    if self.bit >= 8:
-      self.current = ord(self.code[self.index])
-      self.index += 1
-      self.bit = 0
-    
-    bit = self.current & self.masks[self.bit]
-    self.bit += 1
-    return bit
+  nb_states = len(children) // 2
+  nibble_state = []
+  nibble_emit = []
+  for state in range(nb_states):
+    for nibble in range(16):
+      node = state
+      emit = ""
+      for i in range(3, -1, -1):
+        node = children[2 * node + ((nibble >> i) & 1)]
+        if node < 0:
+          if ~node == EOS:
+            node = EOS_STATE
+            break
+          emit += chr(~node)
+          node = 0
+      nibble_state.append(node)
+      nibble_emit.append(emit)
   
-  def has_bits(self):
-    return self.index < len(self.code) or self.bit < 8
-    
+  next_state = []
+  emitted = []
+  for state in range(nb_states):
+    for byte in range(256):
+      high = (state << 4) | (byte >> 4)
+      middle = nibble_state[high]
+      if middle == EOS_STATE:
+        next_state.append(EOS_STATE)
+        emitted.append(nibble_emit[high])
+      else:
+        low = (middle << 4) | (byte & 0x0F)
+        next_state.append(nibble_state[low])
+        emitted.append(nibble_emit[high] + nibble_emit[low])
+  return next_state, emitted
+
 class HuffmanCodec(object):
-  """Class for encoding/decoding strings."""
+  """
+  Class for encoding/decoding strings.
+  
+  The code is the canonical code having the same code lengths as the
+  Huffman tree built from the statistics. Encoding and decoding are driven
+  by tables computed once, so that a codec can be shared.
+  """
   def __init__(self, stats):
     stats = normalize_stats(stats)
     nodes, root = create_tree(stats)
-    self.encoder = dict((n.symbol, n.encoding()) for n in nodes)
-    self.bit_encoder = BitEncoder()
-    self.root = root
-    self.bit_decoder = BitDecoder()
+    lengths = dict((ord(n.symbol) if n.symbol != EOS else EOS,
+                    n.encoding()[1]) for n in nodes)
+    codes = canonical_codes(lengths)
+    # (code, length) by symbol
+    self.encoder = [(codes[s], lengths[s]) for s in range(EOS + 1)]
+    self.next_state, self.emitted = decoding_tables(codes, lengths)
   
   def encode(self, s):
-    self.bit_encoder.reset()
-    for c in s:
-      code = self.encoder[c]
-      self.bit_encoder.push_bits(*code)
-    self.bit_encoder.push_bits(*self.encoder[256])
-    return self.bit_encoder.code()
+    encoder = self.encoder
+    res = bytearray()
+    current = 0
+    bits = 0
+    for c in bytearray(s):
+      code, length = encoder[c]
+      current = (current << length) | code
+      bits += length
+      while bits >= 8:
+        bits -= 8
+        res.append((current >> bits) & 0xFF)
+      current &= (1 << bits) - 1
+    code, length = encoder[EOS]
+    current = (current << length) | code
+    bits += length
+    # Pad the last byte with 0 bits
+    current <<= (8 - bits % 8) % 8
+    bits += (8 - bits % 8) % 8
+    while bits:
+      bits -= 8
+      res.append((current >> bits) & 0xFF)
+    return str(res)
   
-  def decode(self, s):
-    last = 0
-    res = ""
-    self.bit_decoder.reset(s)
-    while last != 256:
-      node = self.root
-      while node.left_child:
-        code = self.bit_decoder.next_bit()
-        if code:
-          node = node.right_child
-        else:
-          node = node.left_child
-      last = node.symbol
-      if type(last) != int:
-        res += last
-    
-    return res, self.bit_decoder.index
+  def decode(self, s, start=0):
+    """
+    Decode the string found in s from index start, up to EOS.
+    Returns the string and the number of bytes consumed.
+    """
+    next_state = self.next_state
+    emitted = self.emitted
+    res = []
+    state = 0
+    for i in range(start, len(s)):
+      index = (state << 8) | ord(s[i])
+      res.append(emitted[index])
+      state = next_state[index]
+      if state == EOS_STATE:
+        return "".join(res), i + 1 - start
+    raise Exception("Huffman string not terminated by EOS")
 
 #===============================================================================
 # Request stats
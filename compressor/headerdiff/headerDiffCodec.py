@@ -30,10 +30,15 @@ Codec implementing HeaderDiff format.
 This implementation does not target efficiency but readability.
 """
 
-from struct import pack, unpack
+from bisect import bisect_left, insort
+from heapq import heappush, heappop
+from itertools import count
+from struct import pack
 import zlib
 
 from Huffman import request_codec, response_codec
+from .. import primed_compressor, primed_decompressor
+from ..varint import BYTES, MAX_PREFIX, encode_integer, decode_integer
 
 # Different types of Delta-encoding
 DELTA_FULL = "delta_full"   # Full Delta encoding
@@ -62,17 +67,161 @@ class IndexedHeader(object):
   Class used by Encoder for storing indexed headers
   (See Section 3.1.1 Header Table).
   """
-  def __init__(self, name, value, index):
+  def __init__(self, name, value, index, lastUse=0):
     self.name = name
     self.value = value
     self.index = index
     # Full is used by encoder as a key to find an indexed header
     self.full = name + value
-    # Age is used by encoder when determining header representation
-    self.age = 0
+    # Last encoding in which the header was used: the age of the header,
+    # used by encoder when determining header representation, is the number
+    # of encodings since then
+    self.lastUse = lastUse
     # Number of usage as a reference for a delta-encoding
     self.delta_usage = 0
 
+class DeltaIndex(object):
+  """
+  Class used by Encoder for finding delta-encoding references.
+  For each header name, the values of the indexed headers usable as a
+  reference are kept sorted: the value sharing the longest common prefix
+  with a given value is then one of the neighbours of its insertion point.
+  """
+  def __init__(self):
+    # Sorted list of values, per header name
+    self.values = {}
+    # Indexed header, per header name and value
+    self.headers = {}
+
+  def add(self, indexedHeader):
+    name = indexedHeader.name
+    if name not in self.values:
+      self.values[name] = []
+      self.headers[name] = {}
+    insort(self.values[name], indexedHeader.value)
+    self.headers[name][indexedHeader.value] = indexedHeader
+
+  def remove(self, indexedHeader):
+    name = indexedHeader.name
+    headers = self.headers.get(name)
+    if not headers or headers.get(indexedHeader.value) is not indexedHeader:
+      return
+    values = self.values[name]
+    del values[bisect_left(values, indexedHeader.value)]
+    del headers[indexedHeader.value]
+
+  def longest_prefix(self, name, value):
+    """
+    Returns the indexed header whose value has the longest common prefix
+    with value, together with the length of this prefix.
+    """
+    values = self.values.get(name)
+    if not values:
+      return None, 0
+    headers = self.headers[name]
+    i = bisect_left(values, value)
+    best, k = None, -1
+    for candidate in values[max(i-1, 0):i+1]:
+      l = common_prefix(value, candidate)
+      # On a tie, prefer the oldest index (more stable references)
+      if l > k or (l == k and headers[candidate].index < best.index):
+        best, k = headers[candidate], l
+    return best, k
+
+class AgeIndex(object):
+  """
+  Class used by Encoder for finding the least recently used indexed header
+  whose value is longer than a given length.
+  Indexed headers are kept in one heap per value length, ordered by last
+  use then index. A segment tree over value lengths holds the (last use,
+  index) of the top of each heap, so that the oldest header above a given
+  length, the one with the lowest index among equally old ones, is found
+  in logarithmic time.
+  Last uses only increase: instead of being updated on each use, a heap
+  entry is re-pushed when found to be outdated at the top of its heap.
+  """
+  def __init__(self, maxLength):
+    self.size = 1
+    while self.size <= maxLength:
+      self.size <<= 1
+    # Oldest (lastUse, index) per range of value lengths (leaves start at
+    # size)
+    self.tree = [NEVER_USED_KEY] * (2 * self.size)
+    # Heap of (lastUse, index, sequence, header), per value length
+    self.heaps = {}
+    # Headers currently indexed (removed ones are discarded lazily)
+    self.live = set()
+    self.sequence = count()
+
+  def add(self, indexedHeader):
+    self.live.add(indexedHeader)
+    self.push(indexedHeader, min(len(indexedHeader.value), self.size - 1))
+
+  def remove(self, indexedHeader):
+    self.live.discard(indexedHeader)
+
+  def push(self, indexedHeader, length):
+    heap = self.heaps.setdefault(length, [])
+    heappush(heap, (indexedHeader.lastUse, indexedHeader.index,
+                    next(self.sequence), indexedHeader))
+    self.update(length)
+
+  def update(self, length):
+    heap = self.heaps.get(length)
+    i = self.size + length
+    self.tree[i] = heap[0][:2] if heap else NEVER_USED_KEY
+    i >>= 1
+    while i:
+      self.tree[i] = min(self.tree[2*i], self.tree[2*i+1])
+      i >>= 1
+
+  def oldest_node(self, minLength):
+    """
+    Returns the tree node holding the oldest (lastUse, index) for value
+    lengths of at least minLength.
+    """
+    lo = self.size + minLength
+    hi = 2 * self.size
+    best = None
+    while lo < hi:
+      if lo & 1:
+        if best is None or self.tree[lo] < self.tree[best]:
+          best = lo
+        lo += 1
+      if hi & 1:
+        hi -= 1
+        if best is None or self.tree[hi] < self.tree[best]:
+          best = hi
+      lo >>= 1
+      hi >>= 1
+    return best
+
+  def oldest(self, maxLastUse, minLength):
+    """
+    Returns the least recently used indexed header, last used no later
+    than maxLastUse and whose value is at least minLength long.
+    """
+    minLength = max(minLength, 0)
+    if minLength >= self.size:
+      return None
+    while True:
+      node = self.oldest_node(minLength)
+      if self.tree[node][0] > maxLastUse:
+        return None
+      # Descend to the leaf (i.e. value length) holding this key
+      while node < self.size:
+        node = 2*node if self.tree[2*node] == self.tree[node] else 2*node+1
+      length = node - self.size
+      heap = self.heaps[length]
+      lastUse, index, sequence, indexedHeader = heappop(heap)
+      if indexedHeader not in self.live:
+        self.update(length)
+      elif indexedHeader.lastUse != lastUse:
+        self.push(indexedHeader, length)
+      else:
+        heappush(heap, (lastUse, index, sequence, indexedHeader))
+        return indexedHeader
+
 class HeaderRepresentation(object):
   """
   Class used by Encoder for defining a header representation
@@ -123,22 +272,22 @@ class HeaderDiffCodec(object):
     self.comp = None
     self.decomp = None
     if self.windowSize != None:
-      self.comp = zlib.compressobj(
-        zlib.Z_DEFAULT_COMPRESSION,
-        zlib.DEFLATED,
-        self.windowSize,
-        8,
-        zlib.Z_DEFAULT_STRATEGY)
-      self.decomp = zlib.decompressobj()
-      if self.dictionary:
-        data = self.comp.compress(self.dictionary)
-        data += self.comp.flush(zlib.Z_SYNC_FLUSH)
-        self.decomp.decompress(data)
+      # Primed contexts are shared between codecs, and copied
+      self.comp = primed_compressor(wbits=self.windowSize,
+                                    dictionary=self.dictionary)
+      self.decomp = primed_decompressor(wbits=self.windowSize,
+                                        dictionary=self.dictionary)
     # Encoder variables
     # Table comprising indexed headers
     self.headersTableEncoder = {}
     # Total length of indexed headers (see Section 3.1.1)
     self.headersTableEncoderSize = 0
+    # Indexed headers usable as a reference for a delta-encoding
+    self.deltaIndexEncoder = DeltaIndex()
+    # Indexed headers, by age and value length
+    self.ageIndexEncoder = AgeIndex(self.indexedHeadersMaxSize)
+    # Number of encodings, used for computing indexed headers age
+    self.encoderGeneration = 0
     # List of header names (encoder, request) (see Section 3.1.2)
     self.headerNamesEncoderRequestTable = {}
     # List of header names (encoder, response) (see Section 3.1.2)
@@ -177,6 +326,7 @@ class HeaderDiffCodec(object):
     # If Deflate was used, apply Inflate
     if self.windowSize != None:
       self.decodedStream = self.decomp.decompress(stream)
+    self.decodedBytes = bytearray(self.decodedStream)
     # Initialize variables
     headers = [] # List of decoded headers
     # Decode number of headers
@@ -293,35 +443,21 @@ class HeaderDiffCodec(object):
     """
     Method for reading the next byte.
     """
-    (b,) = unpack("!B", self.decodedStream[self.decodedStreamIndex])
+    b = self.decodedBytes[self.decodedStreamIndex]
     self.decodedStreamIndex+= 1
     return b
 
-  # Remark: this method does not aim at handling all possible cases,
-  # but only the ones that may occur according to format specification.
   def readInteger(self, currentByte, prefixBits):
     """
     Method for decoding an integer value
     (see Section 4.1.1 Integer Representation).
+    Unless prefixBits is 0, currentByte must be the byte just read.
     """
-    # Read value encoded on prefix bits
-    value = currentByte
-    if prefixBits <= 8:
-      value = value & MAX_VALUES[prefixBits]
-    else:
-      value = value & MAX_VALUES[prefixBits-8]
-      value = (value << 8) | (self.readNextByte() & MAX_VALUES[8])
-    if value == MAX_VALUES[prefixBits]:
-      value = MAX_VALUES[prefixBits]
-      # Read (value-(MAX_VALUES[prefixBits]+1)) on next bits
-      b = self.readNextByte()
-      f = 1
-      while b & 0x80 > 0:
-        value+= (b & 0x7f)*f
-        f = f*128
-        b = self.readNextByte()
-      value+= b*f
-
+    offset = self.decodedStreamIndex
+    if prefixBits:
+      offset -= 1
+    value, self.decodedStreamIndex = decode_integer(self.decodedBytes, offset,
+                                                    prefixBits)
     return value
 
   def readLiteralString(self):
@@ -331,9 +467,11 @@ class HeaderDiffCodec(object):
     """
     if self.huffman:
       if self.isRequest:
-        value, length = self.request_codec.decode(self.decodedStream[self.decodedStreamIndex:])
+        value, length = self.request_codec.decode(self.decodedStream,
+                                                  self.decodedStreamIndex)
       else:
-        value, length = self.response_codec.decode(self.decodedStream[self.decodedStreamIndex:])
+        value, length = self.response_codec.decode(self.decodedStream,
+                                                   self.decodedStreamIndex)
       self.decodedStreamIndex += length
     else:
       length = self.readInteger(0, 0) # No prefix bits
@@ -351,8 +489,7 @@ class HeaderDiffCodec(object):
     Method for encoding a set of headers
     """
     # Before encoding, increment age of indexed headers
-    for ih in self.headersTableEncoder:
-      self.headersTableEncoder[ih].age+= 1
+    self.encoderGeneration+= 1
     # Set the right table
     headerNamesTable = (self.headerNamesEncoderRequestTable if isRequest
                         else self.headerNamesEncoderResponseTable)
@@ -399,10 +536,15 @@ class HeaderDiffCodec(object):
           # Remove replaced header, add new one and update table size
           # (as defined in Section 3.1.1 Header Table)
           del self.headersTableEncoder[hr.referenceHeader.full]
+          self.deltaIndexEncoder.remove(hr.referenceHeader)
+          self.ageIndexEncoder.remove(hr.referenceHeader)
           self.headersTableEncoder[headerFull] = IndexedHeader(
             headerName,
             headerValue,
-            hr.referenceHeader.index)
+            hr.referenceHeader.index,
+            self.encoderGeneration)
+          self.deltaIndexEncoder.add(self.headersTableEncoder[headerFull])
+          self.ageIndexEncoder.add(self.headersTableEncoder[headerFull])
           self.headersTableEncoderSize-=len(hr.referenceHeader.value)
           self.headersTableEncoderSize+=len(headerValue)
         elif hr.indexing == INCREMENTAL_INDEXING:
@@ -413,7 +555,10 @@ class HeaderDiffCodec(object):
           self.headersTableEncoder[headerFull] = IndexedHeader(
             headerName,
             headerValue,
-            len(self.headersTableEncoder))
+            len(self.headersTableEncoder),
+            self.encoderGeneration)
+          self.deltaIndexEncoder.add(self.headersTableEncoder[headerFull])
+          self.ageIndexEncoder.add(self.headersTableEncoder[headerFull])
           self.headersTableEncoderSize+= len(headerValue)
         #############################################################
         ## Serialize using delta or literal representation         ##
@@ -429,6 +574,11 @@ class HeaderDiffCodec(object):
           # Encode common prefix length
           self.writeInteger(b, 0, hr.commonPrefixLength)
           hr.referenceHeader.delta_usage += 1
+          # Once its usage limit is reached, a header can no longer be
+          # used as a reference
+          if (self.delta_type == DELTA_MAX and
+              hr.referenceHeader.delta_usage >= self.delta_param):
+            self.deltaIndexEncoder.remove(hr.referenceHeader)
         else:
           # Literal Representation (see Sections 4.3.1 / 4.3.2)
           # '00' at the beginning of the byte (nothing to do)
@@ -476,7 +626,7 @@ class HeaderDiffCodec(object):
     if headerFull in self.headersTableEncoder:
       hr.representation = INDEXED_REPRESENTATION
       hr.referenceHeader = self.headersTableEncoder[headerFull]
-      hr.referenceHeader.age = 0
+      hr.referenceHeader.lastUse = self.encoderGeneration
       return hr
 
     if not self.delta_usage and headerName == ':path':
@@ -490,25 +640,19 @@ class HeaderDiffCodec(object):
     deltaSubstitutionAddedLength = 0
     
     if self.delta_usage:
-      for hf in self.headersTableEncoder:
-        indexedHeader = self.headersTableEncoder[hf]
-        if indexedHeader.name == headerName:
-          if self.delta_type == DELTA_MAX and indexedHeader.delta_usage >= self.delta_param:
-            continue
-          # Determine common prefix length between value to encode and
-          # indexed header value
-          iv = indexedHeader.value
-          if self.delta_type == DELTA_FULL:
-            k = common_prefix(headerValue, iv)
-          elif self.delta_type == DELTA_BOUND:
-            k = common_prefix_limited(headerValue, iv, self.delta_param)
-          else:
-            k = common_prefix(headerValue, iv)
-          if k >= commonPrefixLength:
-            commonPrefixLength = k
-            deltaSubstitutionHeader = indexedHeader
-            deltaSubstitutionAddedLength = (
-              len(headerValue) - len(indexedHeader.value))
+      # Headers over their DELTA_MAX usage are not part of the index
+      indexedHeader, k = self.deltaIndexEncoder.longest_prefix(
+        headerName, headerValue)
+      if indexedHeader != None:
+        # The bounded prefix only depends on the full common prefix length,
+        # so the best full match is also the best bounded match
+        if self.delta_type == DELTA_BOUND:
+          k = common_prefix_limited(headerValue, indexedHeader.value,
+                                    self.delta_param)
+        commonPrefixLength = k
+        deltaSubstitutionHeader = indexedHeader
+        deltaSubstitutionAddedLength = (
+          len(headerValue) - len(indexedHeader.value))
 
     lengthOK = (self.headersTableEncoderSize + len(headerValue) < self.indexedHeadersMaxSize)
 
@@ -541,18 +685,12 @@ class HeaderDiffCodec(object):
 
     # Look for least recently used indexed header
     # (it may be selected for literal substitution)
-    lruh = None
-
-    for hf in self.headersTableEncoder:
-      indexedHeader = self.headersTableEncoder[hf]
-      if indexedHeader.age > 1:
-        addedDataLength = len(headerValue) - len(indexedHeader.value)
-        remainingSize = self.indexedHeadersMaxSize - self.headersTableEncoderSize
-        if addedDataLength < remainingSize:
-          if not lruh:
-            lruh = indexedHeader
-          elif indexedHeader.age > lruh.age:
-            lruh = indexedHeader
+    # Its age must be over 1, and its replacement must fit in the table
+    # (i.e. addedDataLength < remainingSize)
+    remainingSize = self.indexedHeadersMaxSize - self.headersTableEncoderSize
+    lruh = self.ageIndexEncoder.oldest(
+      self.encoderGeneration - 2,
+      len(headerValue) - remainingSize + 1)
 
     if lruh != None:
         hr.indexing = SUBSTITUTION_INDEXING
@@ -560,43 +698,17 @@ class HeaderDiffCodec(object):
 
     return hr
   
-  # Remark: This method does not aim at handling all possible cases,
-  # but only the ones that may occur according to format specification.
   def writeInteger(self, currentByte, prefixBits, integerValue):
     """
     Method for encoding an integer value
     (see Section 4.1.1 Integer representation)
     """
-    # First, check whether value can be encoded on prefix bits
-    if integerValue < MAX_VALUES[prefixBits]:
-      if prefixBits <= 8:
-        currentByte = currentByte | integerValue
-        self.encodedStream+= pack("!B", currentByte)
-      else:
-        b = currentByte | (integerValue >> 8)
-        b = (b << 8) | (integerValue & 0xff)
-        self.encodedStream+= pack("!H", b)
-    # If value cannot be encoded on prefix bits, write it on next bytes
+    # Most values fit in the prefix: skip the call for those
+    if integerValue < MAX_PREFIX[prefixBits] and prefixBits <= 8:
+      self.encodedStream+= BYTES[currentByte | integerValue]
     else:
-      # If prefix size is greater than 0,
-      # write MAX_VALUE as the prefix
-      if prefixBits > 0:
-        currentByte = currentByte | MAX_VALUES[prefixBits]
-        self.encodedStream+= pack("!B", currentByte)
-      # Write value on next byte or bytes
-      integerValue = integerValue - MAX_VALUES[prefixBits]
-      if integerValue == 0:
-        b = 0
-        self.encodedStream+= pack("!B", b)
-      while integerValue > 0:
-        b = 0
-        q = integerValue/128
-        r = integerValue - q*128
-        if q > 0:
-          b = 0x80
-        b = b | r
-        self.encodedStream+= pack("!B", b)
-        integerValue = q
+      self.encodedStream+= encode_integer(integerValue, prefixBits,
+                                          currentByte)
 
   def writeLiteralString(self, value):
     """
@@ -614,9 +726,6 @@ class HeaderDiffCodec(object):
       self.encodedStream+= str(value)
 
 
-# Maximum values that can be encoded for prefixes of a given length
-# (Section 4.1.1 Integer Representation)
-MAX_VALUES = {0: 0x00, 4: 0x0f, 5: 0x1f, 6: 0x3f, 8: 0xff, 14: 0x3fff}
 # Constants used for representation (Section 3.2 Header Representation)
 LITERAL_REPRESENTATION = 0
 INDEXED_REPRESENTATION = 1
@@ -625,6 +734,9 @@ DELTA_REPRESENTATION = 2
 NO_INDEXING = 0
 INCREMENTAL_INDEXING = 1
 SUBSTITUTION_INDEXING = 2
+# Last use of an empty age index range (later than any encoding)
+NEVER_USED = float("inf")
+NEVER_USED_KEY = (NEVER_USED, NEVER_USED)
 
 # Pre-registered headers for requests (Appendix A.1)
 REGISTERED_HEADERS_REQUESTS = [
@@ -6,6 +6,8 @@ from .. import BaseProcessor, spdy_dictionary, format_http1, parse_http1
 
 class Processor(BaseProcessor):
   def compress(self, in_headers, host):
+    if self.field_sizes is not None:
+      return format_http1(in_headers, record_field=self.record_field)
     return format_http1(in_headers)
 
   def decompress(self, compressed):
@@ -3,15 +3,13 @@
 # found in the LICENSE file.
 
 import zlib
-from .. import BaseProcessor, spdy_dictionary, format_http1
+from .. import BaseProcessor, spdy_dictionary, format_http1, primed_compressor
 
 class Processor(BaseProcessor):
   def __init__(self, options, is_request, params):
     BaseProcessor.__init__(self, options, is_request, params)
-    self.compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION,
-                                       zlib.DEFLATED, 15, 8, zlib.Z_HUFFMAN_ONLY)
-    self.compressor.compress(spdy_dictionary.spdy_dict);
-    self.compressor.flush(zlib.Z_SYNC_FLUSH)
+    self.compressor = primed_compressor(strategy=zlib.Z_HUFFMAN_ONLY,
+                                        dictionary=spdy_dictionary.spdy_dict)
 
   def compress(self, in_headers, host):
     http1_msg = format_http1(in_headers)
@@ -25,7 +25,9 @@
 # OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-from struct import pack, unpack
+from struct import pack
+
+from ..varint import BYTES, MAX_PREFIX, encode_integer, decode_integer
 
 class HeaderEntry(object):
   """
@@ -142,6 +144,7 @@ class HTTP2Codec(object):
     # Strip the frame header.
     frame_header = stream[0:8]
     self.decoded_stream = stream[8:]
+    self.decoded_bytes = bytearray(self.decoded_stream)
     self.decoded_stream_index = 0
     
     # Initialize variables.
@@ -212,28 +215,17 @@ class HTTP2Codec(object):
   
   def read_next_byte(self):
     """Read a byte from the encoded stream."""
-    (byte, ) = unpack("!B", self.decoded_stream[self.decoded_stream_index])
+    byte = self.decoded_bytes[self.decoded_stream_index]
     self.decoded_stream_index += 1
     return byte
   
   def read_integer(self, byte, prefix_size):
-    """Decode an integer value."""
-    if prefix_size <= 8:
-      value = byte & MAX_VALUES[prefix_size]
-    else:
-      value = byte & MAX_VALUES[prefix_size-8]
-      b = self.read_next_byte()
-      value = (value << 8) | (b)
-    
-    if value == MAX_VALUES[prefix_size]:
-      b = self.read_next_byte()
-      shift = 0
-      while b & 0x80 > 0:
-        value += (b & 0x7f) << shift
-        shift += 7
-        b = self.read_next_byte()
-      value += (b & 0x7f) << shift
-    
+    """Decode an integer value, whose prefix is in the byte just read."""
+    offset = self.decoded_stream_index
+    if prefix_size:
+      offset -= 1
+    value, self.decoded_stream_index = decode_integer(self.decoded_bytes,
+                                                      offset, prefix_size)
     return value
   
   def read_literal_string(self):
@@ -438,29 +430,11 @@ class HTTP2Codec(object):
   
   def write_integer(self, byte, prefix_size, value):
     """Encoding an integer."""
-    if value < MAX_VALUES[prefix_size]:
-      if prefix_size <= 8:
-        byte = byte + value
-        self.encoded_stream += pack("!B", byte)
-      else:
-        byte = byte | (value >> 8)
-        byte = (byte << 8) | (value & 0xFF)
-        self.encoded_stream += pack("!H", byte)
+    # Most values fit in the prefix: skip the call for those.
+    if value < MAX_PREFIX[prefix_size] and prefix_size <= 8:
+      self.encoded_stream += BYTES[byte | value]
     else:
-      if prefix_size > 0:
-        byte = byte + MAX_VALUES[prefix_size]
-        self.encoded_stream += pack("!B", byte)
-      value -= MAX_VALUES[prefix_size]
-      if value == 0:
-        self.encoded_stream += pack("!B", 0)
-      while value > 0:
-        q = value >> 7
-        if q > 0:
-          byte = 0x80
-        else:
-          byte = 0
-        self.encoded_stream += pack("!B", byte | (value & 0x7F))
-        value = q
+      self.encoded_stream += encode_integer(value, prefix_size, byte)
   
   def write_literal_string(self, value):
     """Encoding a string."""
@@ -536,16 +510,5 @@ DEFAULT_RESPONSE_HEADERS = [
     ("www-authenticate", ""),
     ]
 
-MAX_VALUES = {
-  0 : 0x00,
-  1 : 0x01,
-  2 : 0x03,
-  3 : 0x07,
-  4 : 0x0f,
-  5 : 0x1f,
-  6 : 0x3f,
-  7 : 0x7f,
-  8 : 0xff,
-  14: 0x3fff}
 
 # vim:et:sw=2:tw=78
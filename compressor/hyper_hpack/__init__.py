@@ -11,6 +11,12 @@ class Processor(BaseProcessor):
 
   def compress(self, in_headers, host):
     headers = [(n,v,n.lower() in self.sensitive) for (n,v) in in_headers.items()]
+    if self.field_sizes is not None:
+      # Encoding one header at a time gives the same block, split by field.
+      fields = [self.compressor.encode([h]) for h in headers]
+      for (h, field) in zip(headers, fields):
+        self.record_field(h[0], len(field))
+      return b''.join(fields)
     return self.compressor.encode(headers)
 
   def decompress(self, compressed):
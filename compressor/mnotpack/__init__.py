@@ -6,12 +6,17 @@ class Processor(BaseProcessor):
   def __init__(self, options, is_request, params):
     BaseProcessor.__init__(self, options, is_request, params)
     self.compressor = mnotpack.Encoder()
-#    self.decompressor = mnotpack.Decoder()
+    self.decompressor = mnotpack.Decoder()
     self.sensitive = []
+    if self.field_sizes is not None:
+      self.compressor.field_hook = self.record_encoded_field
 
   def compress(self, in_headers, host):
     headers = [(n,v,n.lower() in self.sensitive) for (n,v) in in_headers.items()]
     return self.compressor.encode(headers)
 
-#  def decompress(self, compressed):
-#    return self.decompressor.decode(compressed)
+  def record_encoded_field(self, name, size):
+    self.record_field(name.decode('utf-8'), size)
+
+  def decompress(self, compressed):
+    return dict(self.decompressor.decode(compressed))
@@ -5,11 +5,15 @@ hpack/hpack
 
 Implements the HPACK header compression algorithm as detailed by the IETF.
 """
+from collections import OrderedDict
 import logging
 
 import shhh
 import json
 
+from compressor import varint
+from compressor.varint import encode_integer
+
 from .table import HeaderTable, table_entry_size
 from .compat import to_byte, to_bytes
 from .exceptions import (
@@ -19,11 +23,13 @@ from .huffman import HuffmanEncoder
 from .huffman_constants import (
     REQUEST_CODES, REQUEST_CODES_LENGTH
 )
-from .huffman_table import decode_huffman
-from .struct import HeaderTuple, NeverIndexedHeaderTuple
+from .huffman_table import decode_huffman, decode_huffman_prefix
+from .struct import HeaderTuple, NeverIndexedHeaderTuple, StructuredValue
 
-from .sh_backports import backportmap, backport_funcs
-from .sh_binser import SHBinEncoder
+from .sh_backports import (
+    backportmap, backport_funcs, backport_serialisers, serialise_structured
+)
+from .sh_binser import SHBinEncoder, SHBinDecoder
 
 log = logging.getLogger(__name__)
 
@@ -31,10 +37,9 @@ INDEX_NONE = b'\x00'
 INDEX_NEVER = b'\x10'
 INDEX_INCREMENTAL = b'\x40'
 
-# Precompute 2^i for 1-8 for use in prefix calcs.
-# Zero index is not used but there to save a subtraction
-# as prefix numbers are not zero indexed.
-_PREFIX_BIT_MAX_NUMBERS = [(2 ** i) - 1 for i in range(9)]
+# Set alongside the index bits of a literal whose value is a binary Structured
+# Header rather than the field's text.
+STRUCTURED_VALUE = 0x01
 
 try:  # pragma: no cover
     basestring = basestring
@@ -46,6 +51,10 @@ except NameError:  # pragma: no cover
 # lot of headers, but if applications want to raise it they can do.
 DEFAULT_MAX_HEADER_LIST_SIZE = 2 ** 16
 
+# The number of distinct (name, value) pairs whose Structured Header
+# serialisation the encoder remembers.
+DEFAULT_SH_CACHE_SIZE = 4096
+
 
 def _unicode_if_needed(header, raw):
     """
@@ -60,40 +69,6 @@ def _unicode_if_needed(header, raw):
     return header.__class__(name, value)
 
 
-def encode_integer(integer, prefix_bits):
-    """
-    This encodes an integer according to the wacky integer encoding rules
-    defined in the HPACK spec.
-    """
-    log.debug("Encoding %d with %d bits", integer, prefix_bits)
-
-    if integer < 0:
-        raise ValueError(
-            "Can only encode positive integers, got %s" % integer
-        )
-
-    if prefix_bits < 1 or prefix_bits > 8:
-        raise ValueError(
-            "Prefix bits must be between 1 and 8, got %s" % prefix_bits
-        )
-
-    max_number = _PREFIX_BIT_MAX_NUMBERS[prefix_bits]
-
-    if integer < max_number:
-        return bytearray([integer])  # Seriously?
-    else:
-        elements = [max_number]
-        integer -= max_number
-
-        while integer >= 128:
-            elements.append((integer & 127) + 128)
-            integer >>= 7
-
-        elements.append(integer)
-
-        return bytearray(elements)
-
-
 def decode_integer(data, prefix_bits):
     """
     This decodes an integer according to the wacky integer encoding rules
@@ -101,39 +76,13 @@ def decode_integer(data, prefix_bits):
     number of bytes that were consumed from ``data`` in order to get that
     integer.
     """
-    if prefix_bits < 1 or prefix_bits > 8:
-        raise ValueError(
-            "Prefix bits must be between 1 and 8, got %s" % prefix_bits
-        )
-
-    max_number = _PREFIX_BIT_MAX_NUMBERS[prefix_bits]
-    index = 1
-    shift = 0
-    mask = (0xFF >> (8 - prefix_bits))
-
     try:
-        number = to_byte(data[0]) & mask
-        if number == max_number:
-            while True:
-                next_byte = to_byte(data[index])
-                index += 1
-
-                if next_byte >= 128:
-                    number += (next_byte - 128) << shift
-                else:
-                    number += next_byte << shift
-                    break
-                shift += 7
-
+        return varint.decode_integer(data, 0, prefix_bits)
     except IndexError:
         raise HPACKDecodingError(
             "Unable to decode HPACK integer representation from %r" % data
         )
 
-    log.debug("Decoded %d, consumed %d bytes", number, index)
-
-    return number, index
-
 
 def _dict_to_iterable(header_dict):
     """
@@ -166,7 +115,7 @@ class Encoder(object):
     HTTP/2 header blocks.
     """
 
-    def __init__(self):
+    def __init__(self, sh_cache_size=DEFAULT_SH_CACHE_SIZE):
         self.header_table = HeaderTable()
         self.huffman_coder = HuffmanEncoder(
             REQUEST_CODES, REQUEST_CODES_LENGTH
@@ -174,6 +123,18 @@ class Encoder(object):
         self.sh_encoder = SHBinEncoder(self.huffman_coder, encode_integer)
         self.table_size_changes = []
 
+        #: Least recently used cache of (name, value) to what
+        #: :meth:`_structure` made of it, holding at most ``sh_cache_size``
+        #: entries.
+        self.sh_cache = OrderedDict()
+        self.sh_cache_size = sh_cache_size
+        self.sh_cache_hits = 0
+        self.sh_cache_misses = 0
+
+        #: If set, called with the name and encoded size of each header
+        #: field as it is encoded.
+        self.field_hook = None
+
     @property
     def header_table_size(self):
         """
@@ -261,7 +222,10 @@ class Encoder(object):
                 sensitive = header[2]
 
             header = (_to_bytes(header[0]), _to_bytes(header[1]))
-            header_block.append(self.add(header, sensitive, huffman))
+            encoded = self.add(header, sensitive, huffman)
+            header_block.append(encoded)
+            if self.field_hook is not None:
+                self.field_hook(header[0], len(encoded))
 
         header_block = b''.join(header_block)
 
@@ -284,32 +248,55 @@ class Encoder(object):
         
         # header field value is more complicated. First, we see if we know how to parse it.
         norm_name = name.lower()
-        header_type = backportmap.get(norm_name, None)
-        header_func = backport_funcs.get(norm_name, None)
-        import sys
-        if header_type or header_func:
+        if norm_name in backportmap or norm_name in backport_funcs:
             # We can parse it somehow; let's make it into a SH.
-            orig_value = value
-            try:
-                raw_value = value.decode('utf-8', 'ignore')
-                if header_func:
-                    parsed_value = header_func(raw_value)
-                else:
-                    parsed_value = shhh.parse(raw_value, header_type)
-                # Now we serialise it into a binary representation of the SH.
-                value = bytes(self.sh_encoder.serialise(parsed_value))
-#                huffman = False
-#                orig_huf = len(self.huffman_coder.encode(orig_value))
-#                sys.stderr.write("* %25s: %3i to %3i bytes - %3i %s\n" % (
-#                  name, orig_huf, len(value), orig_huf - len(value), orig_value))
-            except ValueError:
-                # SH parsing failed; we fall back to making it a "raw" header.
-                pass
-        else:
-            sys.stderr.write("* %25s: %3i\n" % (name, len(value)))
+            value = self._structure(norm_name, value)
         encoded += self._lookup(value, indexbit, sensitive, huffman)
         return encoded
 
+    def _structure(self, norm_name, value):
+        """
+        Returns the binary Structured Header for a value of the named header,
+        or the value itself if it can't be parsed. Parsing and serialising is
+        only done once for each recently seen (name, value) pair.
+        """
+        key = (norm_name, value)
+        try:
+            structured = self.sh_cache[key]
+        except KeyError:
+            self.sh_cache_misses += 1
+        else:
+            self.sh_cache_hits += 1
+            self.sh_cache.move_to_end(key)
+            return structured
+
+        structured = value
+        try:
+            raw_value = value.decode('utf-8', 'ignore')
+            header_func = backport_funcs.get(norm_name, None)
+            if header_func:
+                parsed_value = header_func(raw_value)
+            else:
+                parsed_value = shhh.parse(raw_value, backportmap[norm_name])
+            # The decoder can only give back the canonical text of the SH,
+            # so only send it as one if that's what we were given.
+            serialise = backport_serialisers.get(
+                norm_name, serialise_structured
+            )
+            if serialise(parsed_value) == raw_value:
+                # Now we serialise it into a binary representation of the SH.
+                structured = StructuredValue(
+                    self.sh_encoder.serialise(parsed_value)
+                )
+        except ValueError:
+            # SH parsing failed; we fall back to making it a "raw" header.
+            pass
+
+        self.sh_cache[key] = structured
+        if len(self.sh_cache) > self.sh_cache_size:
+            self.sh_cache.popitem(last=False)
+        return structured
+
     def _lookup(self, item, indexbit, sensitive, huffman):
         match = self.header_table.search(item)
         if match is None:
@@ -327,26 +314,24 @@ class Encoder(object):
         """
         Encodes a header using the indexed representation.
         """
-        field = encode_integer(index, 7)
-        field[0] |= 0x80  # we set the top bit
-        return bytes(field)
+        return encode_integer(index, 7, 0x80)  # we set the top bit
 
     def _encode_literal(self, value, indexbit, huffman=False):
         """
         Encodes a header with a literal name and literal value. If ``indexing``
         is True, the header will be added to the header table: otherwise it
-        will not.
+        will not. A :class:`StructuredValue` is flagged as such.
         """
+        if isinstance(value, StructuredValue):
+            indexbit = bytes([indexbit[0] | STRUCTURED_VALUE])
+
         if huffman:
             value = self.huffman_coder.encode(value)
 
-        value_len = encode_integer(len(value), 7)
-
-        if huffman:
-            value_len[0] |= 0x80
+        value_len = encode_integer(len(value), 7, 0x80 if huffman else 0)
 
         return b''.join(
-            [indexbit, bytes(value_len), value]
+            [indexbit, value_len, value]
         )
 
     def _encode_table_size_change(self):
@@ -356,9 +341,7 @@ class Encoder(object):
         """
         block = b''
         for size_bytes in self.table_size_changes:
-            size_bytes = encode_integer(size_bytes, 5)
-            size_bytes[0] |= 0x20
-            block += bytes(size_bytes)
+            block += encode_integer(size_bytes, 5, 0x20)
         self.table_size_changes = []
         return block
 
@@ -412,6 +395,10 @@ class Decoder(object):
         #: to confirm that it fits in this size.
         self.max_allowed_table_size = self.header_table.maxsize
 
+        self.sh_decoder = SHBinDecoder(
+            decode_huffman_prefix, varint.decode_integer
+        )
+
     @property
     def header_table_size(self):
         """
@@ -445,58 +432,65 @@ class Decoder(object):
         data_len = len(data)
         inflated_size = 0
         current_index = 0
+        # Names and values are sent as separate fields, so this holds a
+        # decoded name until its value has been decoded too.
+        name = None
 
         while current_index < data_len:
-            # Work out what kind of header we're decoding.
+            # Work out what kind of field we're decoding.
             # If the high bit is 1, it's an indexed field.
             current = to_byte(data[current_index])
             indexed = True if current & 0x80 else False
 
-            # Otherwise, if the second-highest bit is 1 it's a field that does
-            # alter the header table.
-            literal_index = True if current & 0x40 else False
-
             # Otherwise, if the third-highest bit is 1 it's an encoding context
-            # update.
+            # update. Literals never set it.
             encoding_update = True if current & 0x20 else False
 
             if indexed:
-                header, consumed = self._decode_indexed(
-                    data_mem[current_index:]
-                )
-            elif literal_index:
-                # It's a literal header that does affect the header table.
-                header, consumed = self._decode_literal_index(
+                field, consumed = self._decode_indexed(
                     data_mem[current_index:]
                 )
             elif encoding_update:
                 # It's an update to the encoding context. These are forbidden
                 # in a header block after any actual header.
-                if headers:
+                if headers or name is not None:
                     raise HPACKDecodingError(
                         "Table size update not at the start of the block"
                     )
                 consumed = self._update_encoding_context(
                     data_mem[current_index:]
                 )
-                header = None
+                field = None
             else:
-                # It's a literal header that does not affect the header table.
-                header, consumed = self._decode_literal_no_index(
+                field, consumed = self._decode_literal(
                     data_mem[current_index:]
                 )
 
-            if header:
-                headers.append(header)
-                inflated_size += table_entry_size(*header)
+            current_index += consumed
 
-                if inflated_size > self.max_header_list_size:
-                    raise OversizedHeaderListError(
-                        "A header list larger than %d has been received" %
-                        self.max_header_list_size
-                    )
+            if field is None:
+                continue
+            if name is None:
+                name = field
+                continue
+
+            # Only literal values can be marked as never to be indexed.
+            not_indexable = not indexed and current & 0x10
+            header = self._decode_header(name, field, not_indexable)
+            name = None
+            headers.append(header)
+            inflated_size += (
+                table_entry_size(header[0]) + table_entry_size(header[1])
+            )
 
-            current_index += consumed
+            if inflated_size > self.max_header_list_size:
+                raise OversizedHeaderListError(
+                    "A header list larger than %d has been received" %
+                    self.max_header_list_size
+                )
+
+        if name is not None:
+            raise HPACKDecodingError("Truncated header block")
 
         # Confirm that the table size is lower than the maximum. We do this
         # here to ensure that we catch when the max has been *shrunk* and the
@@ -533,90 +527,71 @@ class Decoder(object):
 
     def _decode_indexed(self, data):
         """
-        Decodes a header represented using the indexed representation.
+        Decodes a field represented using the indexed representation.
         """
         index, consumed = decode_integer(data, 7)
-        header = HeaderTuple(*self.header_table.get_by_index(index))
-        log.debug("Decoded %s, consumed %d", header, consumed)
-        return header, consumed
+        field = self.header_table.get_by_index(index)
+        log.debug("Decoded %s, consumed %d", field, consumed)
+        return field, consumed
 
-    def _decode_literal_no_index(self, data):
-        return self._decode_literal(data, False)
-
-    def _decode_literal_index(self, data):
-        return self._decode_literal(data, True)
-
-    def _decode_literal(self, data, should_index):
+    def _decode_literal(self, data):
         """
-        Decodes a header represented with a literal.
+        Decodes a field represented with a literal.
         """
-        total_consumed = 0
-
-        # When should_index is true, if the low six bits of the first byte are
-        # nonzero, the header name is indexed.
-        # When should_index is false, if the low four bits of the first byte
-        # are nonzero the header name is indexed.
-        if should_index:
-            indexed_name = to_byte(data[0]) & 0x3F
-            name_len = 6
-            not_indexable = False
-        else:
-            high_byte = to_byte(data[0])
-            indexed_name = high_byte & 0x0F
-            name_len = 4
-            not_indexable = high_byte & 0x10
-
-        if indexed_name:
-            # Indexed header name.
-            index, consumed = decode_integer(data, name_len)
-            name = self.header_table.get_by_index(index)[0]
-
-            total_consumed = consumed
-            length = 0
-        else:
-            # Literal header name. The first byte was consumed, so we need to
-            # move forward.
-            data = data[1:]
-
-            length, consumed = decode_integer(data, 7)
-            name = data[consumed:consumed + length]
-            if len(name) != length:
-                raise HPACKDecodingError("Truncated header block")
+        flags = to_byte(data[0])
+        should_index = flags & 0x40
 
-            if to_byte(data[0]) & 0x80:
-                name = decode_huffman(name)
-            total_consumed = consumed + length + 1  # Since we moved forward 1.
+        # The first byte only holds flags, so we need to move forward.
+        data = data[1:]
 
-        data = data[consumed + length:]
-
-        # The header value is definitely length-based.
         length, consumed = decode_integer(data, 7)
-        value = data[consumed:consumed + length]
-        if len(value) != length:
+        field = data[consumed:consumed + length]
+        if len(field) != length:
             raise HPACKDecodingError("Truncated header block")
 
         if to_byte(data[0]) & 0x80:
-            value = decode_huffman(value)
+            field = decode_huffman(field)
+        else:
+            field = field.tobytes()
 
-        # Updated the total consumed length.
-        total_consumed += length + consumed
+        if flags & STRUCTURED_VALUE:
+            field = StructuredValue(field)
 
-        # If we have been told never to index the header field, encode that in
-        # the tuple we use.
-        if not_indexable:
-            header = NeverIndexedHeaderTuple(name, value)
-        else:
-            header = HeaderTuple(name, value)
+        total_consumed = consumed + length + 1  # Since we moved forward 1.
 
         # If we've been asked to index this, add it to the header table.
         if should_index:
-            self.header_table.add(name, value)
+            self.header_table.add(field)
 
         log.debug(
             "Decoded %s, total consumed %d bytes, indexed %s",
-            header,
+            field,
             total_consumed,
             should_index
         )
 
-        return header, total_consumed
+        return field, total_consumed
+
+    def _decode_header(self, name, value, not_indexable):
+        """
+        Builds a header from its decoded name and value fields, turning a
+        binary Structured Header value back into text.
+        """
+        if isinstance(value, StructuredValue):
+            norm_name = name.lower()
+            try:
+                parsed_value = self.sh_decoder.parse(value)
+            except (ValueError, IndexError) as e:
+                raise HPACKDecodingError(
+                    "Invalid Structured Header for %r: %s" % (name, e)
+                )
+            serialise = backport_serialisers.get(
+                norm_name, serialise_structured
+            )
+            value = serialise(parsed_value).encode('utf-8')
+
+        # If we have been told never to index the header field, encode that in
+        # the tuple we use.
+        if not_indexable:
+            return NeverIndexedHeaderTuple(name, value)
+        return HeaderTuple(name, value)
@@ -6,7 +6,6 @@ hpack/huffman_decoder
 An implementation of a bitwise prefix tree specially built for decoding
 Huffman-coded content where we already know the Huffman table.
 """
-from .compat import to_byte, decode_hex
 
 
 class HuffmanEncoder(object):
@@ -27,20 +26,17 @@ class HuffmanEncoder(object):
         if not bytes_to_encode:
             return b''
 
+        codes = self.huffman_code_list
+        lengths = self.huffman_code_list_lengths
         final_num = 0
         final_int_len = 0
 
         # Turn each byte into its huffman code. These codes aren't necessarily
         # octet aligned, so keep track of how far through an octet we are. To
         # handle this cleanly, just use a single giant integer.
-        for char in bytes_to_encode:
-            byte = to_byte(char)
-            bin_int_len = self.huffman_code_list_lengths[byte]
-            bin_int = self.huffman_code_list[byte] & (
-                2 ** (bin_int_len + 1) - 1
-            )
-            final_num <<= bin_int_len
-            final_num |= bin_int
+        for byte in bytes_to_encode:
+            bin_int_len = lengths[byte]
+            final_num = (final_num << bin_int_len) | codes[byte]
             final_int_len += bin_int_len
 
         # Pad out to an octet with ones.
@@ -48,21 +44,14 @@ class HuffmanEncoder(object):
         final_num <<= bits_to_be_padded
         final_num |= (1 << bits_to_be_padded) - 1
 
-        # Convert the number to hex and strip off the leading '0x' and the
-        # trailing 'L', if present.
-        final_num = hex(final_num)[2:].rstrip('L')
-
-        # If this is odd, prepend a zero.
-        final_num = '0' + final_num if len(final_num) % 2 != 0 else final_num
-
-        # This number should have twice as many digits as bytes. If not, we're
-        # missing some leading zeroes. Work out how many bytes we want and how
-        # many digits we have, then add the missing zero digits to the front.
+        # Leading zero bits are kept by asking for the exact number of bytes.
         total_bytes = (final_int_len + bits_to_be_padded) // 8
-        expected_digits = total_bytes * 2
-
-        if len(final_num) != expected_digits:
-            missing_digits = expected_digits - len(final_num)
-            final_num = ('0' * missing_digits) + final_num
+        return final_num.to_bytes(total_bytes, 'big')
 
-        return decode_hex(final_num)
+    def encode_many(self, strings_to_encode):
+        """
+        Encodes each of an iterable of byte strings, returning a list of the
+        encoded strings, padded as with ``encode``.
+        """
+        encode = self.encode
+        return [encode(string) for string in strings_to_encode]
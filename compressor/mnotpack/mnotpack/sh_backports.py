@@ -69,4 +69,56 @@ backport_funcs = {
   b'date': parse_date,
   b'last-modified': parse_date,
   b'expires': parse_date
-}
\ No newline at end of file
+}
+
+# The reverse of the above: turn what SHBinDecoder returns back into an
+# HTTP/1 field value. Strings can't be told apart from tokens on the wire, so
+# anything that looks like a token is sent bare.
+
+import base64
+import re
+TOKEN = re.compile(r"[A-Za-z*][A-Za-z0-9!#$%&'*+\-.^_`|~:/]*\Z")
+
+def serialise_item(value):
+    if type(value) is bool:
+        return '?1' if value else '?0'
+    if type(value) is int:
+        return str(value)
+    if type(value) is float:
+        text = ("%f" % value).rstrip('0')
+        return text + '0' if text.endswith('.') else text
+    if type(value) is bytes:
+        return ':%s:' % base64.b64encode(value).decode('ascii')
+    if TOKEN.match(value):
+        return value
+    return '"%s"' % value.replace('\\', '\\\\').replace('"', '\\"')
+
+def serialise_member(key, value):
+    if value is True:
+        return key
+    return "%s=%s" % (key, serialise_item(value))
+
+def serialise_structured(value):
+    if type(value) is dict:
+        return ", ".join(serialise_member(k, v) for k, v in value.items())
+    if type(value) is list and value and type(value[0]) is tuple:
+        return ", ".join(
+            ";".join([primary_id] + [serialise_member(k, v) for k, v in params.items()])
+            for primary_id, params in value)
+    if type(value) is list:
+        return ", ".join(serialise_item(i) for i in value)
+    return serialise_item(value)
+
+def serialise_cookie(value):
+    return "; ".join("%s=%s" % (k, v) for k, v in value.items())
+
+from email.utils import formatdate
+def serialise_date(value):
+    return formatdate(value, usegmt=True)
+
+backport_serialisers = {
+  b'cookie': serialise_cookie,
+  b'date': serialise_date,
+  b'last-modified': serialise_date,
+  b'expires': serialise_date
+}
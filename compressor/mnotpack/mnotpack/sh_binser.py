@@ -32,8 +32,7 @@ class SHBinEncoder:
         type: 0x00
         payload: data(varint)
         """
-        value = self.encode_integer(inval, 4)
-        value[0] |= 0x00
+        value = self.encode_integer(inval, 4, 0x00)
         return value
 
     def ser_byteseq(self, byteseq: bytes) -> str:
@@ -42,19 +41,18 @@ class SHBinEncoder:
         payload: len(varint) value
         """
         length = len(byteseq)
-        value = self.encode_integer(length, 4)
-        value[0] |= 0x10
-        return b''.join([value] + byteseq)
+        value = self.encode_integer(length, 4, 0x10)
+        value += byteseq
+        return value
 
     def ser_string(self, inval: str) -> str:
         """
         type: 0x20
         payload: len(varint) data
         """
-        length = len(inval)
-        value = self.encode_integer(length, 4)
-        value[0] |= 0x20
-        value += self.huffman_encode(inval.encode('utf-8'))
+        data = inval.encode('utf-8')
+        value = self.encode_integer(len(data), 4, 0x20)
+        value += self.huffman_encode(data)
         return value
 
     def ser_token(self, token: str) -> str:
@@ -63,8 +61,7 @@ class SHBinEncoder:
         payload: len(varint) data
         """
         length = len(inval)
-        value = self.encode_integer(length, 4)
-        value[0] |= 0x30
+        value = self.encode_integer(length, 4, 0x30)
         value += self.huffman_encode(inval.encode('utf-8'))
         return value
     
@@ -73,10 +70,9 @@ class SHBinEncoder:
         type: 0x40
         payload: 
         """
-        int_val, frac_val = math.modf(inval)
-        value = self.encode_integer(int(int_val), 4)
+        frac_val, int_val = math.modf(inval)
+        value = self.encode_integer(int(int_val), 4, 0x40)
         value += self.encode_integer(int(("%f" % frac_val)[2:]), 8) # HACK
-        value[0] |= 40
         return value
 
     def ser_integer(self, inval: int) -> str:  # FIXME: negative
@@ -84,8 +80,7 @@ class SHBinEncoder:
         type: 0x50
         payload: value(varint)
         """
-        value = self.encode_integer(inval, 4)
-        value[0] |= 0x50
+        value = self.encode_integer(inval, 4, 0x50)
         return value
 
     def ser_item(self, item: Any) -> str:
@@ -110,8 +105,7 @@ class SHBinEncoder:
         payload: num_items(varint) [item...]
         """
         num_items = len(input_list)
-        value = self.encode_integer(num_items, 4)
-        value[0] |= 0x60
+        value = self.encode_integer(num_items, 4, 0x60)
         item_list = [self.ser_item(i) for i in input_list]
         return b''.join([value] + item_list)
     
@@ -128,18 +122,16 @@ class SHBinEncoder:
         payload: num_kvs(varint) (key val)+
         """
         num_kvs = len(input_dict)
-        value = self.encode_integer(num_kvs, 4)
-        value[0] |= 0x80
+        value = self.encode_integer(num_kvs, 4, 0x80)
         for k,v in input_dict.items():
             value += self.ser_key(k)
             value += self.ser_item(v)
         return value
 
     def ser_key(self, inval):
-        length = len(inval)
-        value = self.encode_integer(length, 8)
-        encoded_value = self.huffman_encode(inval.encode('utf-8'))
-        value += encoded_value
+        data = inval.encode('utf-8')
+        value = self.encode_integer(len(data), 8)
+        value += self.huffman_encode(data)
         return value
     
     def ser_paramlist(self, input_list: List) -> str:
@@ -148,8 +140,7 @@ class SHBinEncoder:
         payload: 
         """
         num_items = len(input_list)
-        value = self.encode_integer(num_items, 4)
-        value[0] |= 0x90
+        value = self.encode_integer(num_items, 4, 0x90)
         for i in input_list:
             primary_id = i[0]
             params = i[1]
@@ -161,3 +152,110 @@ class SHBinEncoder:
                 value += self.ser_item(v)
         return value
 
+
+
+class SHBinDecoder:
+    """
+    Reverses SHBinEncoder. Each par_* method takes a memoryview and an offset
+    into it, and returns the parsed value along with the offset just past it;
+    nothing is copied until a string is decoded.
+    """
+    def __init__(self, huffman_decode_prefix, decode_integer):
+        self.huffman_decode_prefix = huffman_decode_prefix
+        self.decode_integer = decode_integer
+        self.item_parsers = {
+            0x00: self.par_boolean,
+            0x10: self.par_byteseq,
+            0x20: self.par_string,
+            0x30: self.par_string,
+            0x40: self.par_float,
+            0x50: self.par_integer,
+        }
+
+    def parse(self, input_data: bytes) -> Any:
+        data = memoryview(input_data)
+        if not data:
+            raise ValueError("Empty input data.")
+        data_type = data[0] & 0xF0
+        if data_type == 0x80:
+            value, offset = self.par_dictionary(data, 0)
+        elif data_type == 0x90:
+            value, offset = self.par_paramlist(data, 0)
+        elif data_type == 0x60:
+            value, offset = self.par_list(data, 0)
+        else:
+            value, offset = self.par_item(data, 0)
+        if offset != len(data):
+            raise ValueError("Trailing data after structured header.")
+        return value
+
+    def _integer(self, data: memoryview, offset: int, prefix_bits: int):
+        return self.decode_integer(data, offset, prefix_bits)
+
+    def _huffman(self, data: memoryview, offset: int, length: int):
+        value, consumed = self.huffman_decode_prefix(data[offset:], length)
+        return value.decode('utf-8'), offset + consumed
+
+    def par_boolean(self, data: memoryview, offset: int):
+        value, offset = self._integer(data, offset, 4)
+        return bool(value), offset
+
+    def par_byteseq(self, data: memoryview, offset: int):
+        length, offset = self._integer(data, offset, 4)
+        if offset + length > len(data):
+            raise ValueError("Truncated byte sequence.")
+        return data[offset:offset + length].tobytes(), offset + length
+
+    def par_string(self, data: memoryview, offset: int):
+        length, offset = self._integer(data, offset, 4)
+        return self._huffman(data, offset, length)
+
+    def par_float(self, data: memoryview, offset: int):
+        int_val, offset = self._integer(data, offset, 4)
+        frac_val, offset = self._integer(data, offset, 8)
+        # ser_float sends the six digits of "%f" without leading zeros.
+        return float("%d.%06d" % (int_val, frac_val)), offset
+
+    def par_integer(self, data: memoryview, offset: int):
+        return self._integer(data, offset, 4)
+
+    def par_item(self, data: memoryview, offset: int):
+        if offset >= len(data):
+            raise ValueError("Truncated item.")
+        parser = self.item_parsers.get(data[offset] & 0xF0)
+        if parser is None:
+            raise ValueError("Item type not recognised.")
+        return parser(data, offset)
+
+    def par_list(self, data: memoryview, offset: int):
+        num_items, offset = self._integer(data, offset, 4)
+        items = []
+        for _ in range(num_items):
+            item, offset = self.par_item(data, offset)
+            items.append(item)
+        return items, offset
+
+    def par_dictionary(self, data: memoryview, offset: int):
+        num_kvs, offset = self._integer(data, offset, 4)
+        output = {}
+        for _ in range(num_kvs):
+            key, offset = self.par_key(data, offset)
+            output[key], offset = self.par_item(data, offset)
+        return output, offset
+
+    def par_key(self, data: memoryview, offset: int):
+        length, offset = self._integer(data, offset, 8)
+        return self._huffman(data, offset, length)
+
+    def par_paramlist(self, data: memoryview, offset: int):
+        num_items, offset = self._integer(data, offset, 4)
+        output = []
+        for _ in range(num_items):
+            primary_id, offset = self.par_key(data, offset)
+            num_params, offset = self._integer(data, offset, 8)
+            params = {}
+            for _ in range(num_params):
+                key, offset = self.par_key(data, offset)
+                params[key], offset = self.par_item(data, offset)
+            output.append((primary_id, params))
+        return output, offset
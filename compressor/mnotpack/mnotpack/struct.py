@@ -37,3 +37,24 @@ class NeverIndexedHeaderTuple(HeaderTuple):
     __slots__ = ()
 
     indexable = False
+
+
+class StructuredValue(bytes):
+    """
+    A header field value that holds a binary Structured Header rather than
+    the field's text.
+
+    It never compares equal to a plain bytestring, so that the header tables
+    can't match a Structured Header against a textual value that happens to
+    have the same bytes.
+    """
+    __slots__ = ()
+
+    def __eq__(self, other):
+        return isinstance(other, StructuredValue) and bytes.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return ~bytes.__hash__(self)
@@ -124,6 +124,12 @@ class HeaderTable(object):
         self._current_size = 0
         self.resized = False
         self.dynamic_entries = deque()
+        # Number of entries ever added to the dynamic table; the newest
+        # entry's insertion counter.
+        self._insert_count = 0
+        # value -> [insertion counter of its newest entry, number of
+        # entries with that value]
+        self._dynamic_index = {}
 
     def get_by_index(self, index):
         """
@@ -166,11 +172,17 @@ class HeaderTable(object):
         # We just clear the table if the entry is too big
         size = table_entry_size(value)
         if size > self._maxsize:
-            self.dynamic_entries.clear()
-            self._current_size = 0
+            self._clear()
         else:
             # Add new entry
             self.dynamic_entries.appendleft(value)
+            self._insert_count += 1
+            indexed = self._dynamic_index.get(value)
+            if indexed is None:
+                self._dynamic_index[value] = [self._insert_count, 1]
+            else:
+                indexed[0] = self._insert_count
+                indexed[1] += 1
             self._current_size += size
             self._shrink()
 
@@ -188,11 +200,12 @@ class HeaderTable(object):
         if index:
             return index, value
         else:
+            indexed = self._dynamic_index.get(value)
+            if indexed is None:
+                return None
+            # Dynamic entries are indexed from the newest one.
             offset = HeaderTable.STATIC_TABLE_LENGTH + 1
-            for (i, v) in enumerate(self.dynamic_entries):
-                if v == value:
-                    return i + offset, v
-            return None
+            return offset + self._insert_count - indexed[0], value
 
     @property
     def maxsize(self):
@@ -206,11 +219,18 @@ class HeaderTable(object):
         self._maxsize = newmax
         self.resized = (newmax != oldmax)
         if newmax <= 0:
-            self.dynamic_entries.clear()
-            self._current_size = 0
+            self._clear()
         elif oldmax > newmax:
             self._shrink()
 
+    def _clear(self):
+        """
+        Empties the dynamic table
+        """
+        self.dynamic_entries.clear()
+        self._dynamic_index.clear()
+        self._current_size = 0
+
     def _shrink(self):
         """
         Shrinks the dynamic table to be at or below maxsize
@@ -219,6 +239,12 @@ class HeaderTable(object):
         while cursize > self._maxsize:
             value = self.dynamic_entries.pop()
             cursize -= table_entry_size(value)
+            # The evicted entry is the oldest one, so the newest entry with
+            # the same value (if any) is still in the table.
+            indexed = self._dynamic_index[value]
+            indexed[1] -= 1
+            if not indexed[1]:
+                del self._dynamic_index[value]
             log.debug("Evicting %s from the header table", value)
         self._current_size = cursize
 
@@ -227,7 +253,7 @@ def _build_static_table_mapping():
     """
     static_table_mapping used for hash searching.
     """
-    return {v: i for i, v in enumerate(HeaderTable.STATIC_TABLE)}
+    return {v: i for i, v in enumerate(HeaderTable.STATIC_TABLE, 1)}
 
 
 HeaderTable.STATIC_TABLE_MAPPING = _build_static_table_mapping()
@@ -2,14 +2,13 @@
 # pylint: disable=W0311
 
 from .. import BaseProcessor, format_http1, parse_http1
-from collections import defaultdict
+from collections import OrderedDict
 import re
 import calendar
 from email.utils import parsedate as lib_parsedate
 from email.utils import formatdate as lib_formatdate
 from urlparse import urlsplit
 import os.path  
-from copy import copy
 import zlib
 
 import seven
@@ -87,8 +86,8 @@ class Processor(BaseProcessor):
   
   def __init__(self, options, is_request, params):
     BaseProcessor.__init__(self, options, is_request, params)
-    self.last_c = None
-    self.last_d = None
+    self.last_c = {}
+    self.last_d = {}
     self.rev_lookups = {v:k for k, v in self.lookups.items()}
     if "seven" in params:
       self.encode = seven.encode
@@ -113,21 +112,18 @@ class Processor(BaseProcessor):
   def compress(self, in_headers, host):
     headers = {}
     refs = []
+    last_c = self.last_c
+    max_entries = self.max_entries
     for name, value in in_headers.items():
-      # look for refs
-      if self.last_c \
-      and name[0] != ":" \
-      and self.last_c.get(name, None) == value \
-      and len(refs) < self.max_entries:
-        refs.append(name)
-        continue
-      elif self.last_c \
-      and name == ':host' \
-      and self.last_c.get(name, None) == value \
-      and len(refs) < self.max_entries:
-          refs.append('h')
+      # look for refs; only the headers that changed get any further work.
+      if last_c.get(name) == value and len(refs) < max_entries:
+        if name[0] != ":":
+          refs.append(self.hdr_name(name))
+          continue
+        elif name == ':host':
+          refs.append('!h')
           continue
-      elif name in self.ignore_hdrs:
+      if name in self.ignore_hdrs:
         continue
       # re-encoding
       if self.compress_dates and name in self.date_hdrs:
@@ -138,7 +134,7 @@ class Processor(BaseProcessor):
       headers[self.hdr_name(name)] = value
     self.last_c = in_headers
     if refs:
-      headers["ref"] = ",".join([self.hdr_name(ref) for ref in refs])
+      headers["ref"] = ",".join(refs)
     if headers.has_key('h'):
       headers[':host'] = headers['h']
       del headers['h']
@@ -152,30 +148,29 @@ class Processor(BaseProcessor):
   def decompress(self, compressed):
     compressed = self.decode(compressed)
     headers = parse_http1(compressed, self.is_request, 'h')
+    # The last headers are kept as returned (i.e., with ':host'), so refs
+    # to "!h" are looked up as ':host', and they needn't be copied.
     out_headers = {}
-    for name in headers.keys():
+    for name, value in headers.items():
       if name == "ref":
         continue
-      elif name == ":host":
-        out_headers['h'] = headers[name]
       elif name[0] == ":":
-        out_headers[name] = headers[name]
+        out_headers[name] = value
       elif name[0] == '!':
-        out_headers[name[1:]] = headers[name]
+        out_headers[self.bang_name(name)] = value
       else:
         expanded_name = self.rev_lookups[name]
         if self.compress_dates and expanded_name in self.date_hdrs:
           try:
-            out_headers[expanded_name] = format_date(int(headers[name], 16))
+            value = format_date(int(value, 16))
           except ValueError:
-            out_headers[expanded_name] = headers[name]
-        else:
-          out_headers[expanded_name] = headers[name]
+            pass
+        out_headers[expanded_name] = value
     if headers.has_key('ref') and self.last_d:
       refs = headers['ref'].split(",")
       for ref in refs:
         if ref[0] == "!":
-          name = ref[1:]
+          name = self.bang_name(ref)
         else:
           name = self.rev_lookups[ref]
         try:
@@ -184,10 +179,7 @@ class Processor(BaseProcessor):
           import sys
           sys.stdout.write("\n\n%s\n\n" % repr(self.last_d))
           raise
-    self.last_d = copy(out_headers)
-    if out_headers.has_key('h'):
-      out_headers[':host'] = out_headers['h']
-      del out_headers['h']
+    self.last_d = out_headers
     return out_headers
 
   def hdr_name(self, name):
@@ -195,6 +187,12 @@ class Processor(BaseProcessor):
       return name
     return self.lookups.get(name, "!%s" % name)
 
+  def bang_name(self, name):
+    "The header name that name (starting with '!') stands for."
+    if name == "!h":
+      return ':host'
+    return name[1:]
+
   def huffman_encode(self, msg):
     return ''.join([
                    self.compressor.compress(msg),
@@ -212,10 +210,30 @@ DATE = r"""(?:\w{3},\ [0-9]{2}\ \w{3}\ [0-9]{4}\ [0-9]{2}:[0-9]{2}:[0-9]{2}\ GMT
          \w{6,9},\ [0-9]{2}\-\w{3}\-[0-9]{2}\ [0-9]{2}:[0-9]{2}:[0-9]{2}\ GMT |
          \w{3}\ \w{3}\ [0-9 ][0-9]\ [0-9]{2}:[0-9]{2}:[0-9]{2}\ [0-9]{4})
         """
-        
+DATE_RE = re.compile(r"%s$" % DATE, re.VERBOSE)
+
+# The most recently parsed dates, and what they parsed to (None if bad).
+DATE_CACHE_SIZE = 1024
+_date_cache = OrderedDict()
+
 def parse_date(value):
     """Parse a HTTP date. Raises ValueError if it's bad."""
-    if not re.match(r"%s$" % DATE, value, re.VERBOSE):
+    try:
+        date = _date_cache.pop(value)
+    except KeyError:
+        try:
+            date = _parse_date(value)
+        except ValueError:
+            date = None
+        if len(_date_cache) >= DATE_CACHE_SIZE:
+            _date_cache.popitem(last=False)
+    _date_cache[value] = date
+    if date is None:
+        raise ValueError
+    return date
+
+def _parse_date(value):
+    if not DATE_RE.match(value):
         raise ValueError
     date_tuple = lib_parsedate(value)
     if date_tuple is None:
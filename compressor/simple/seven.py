@@ -6,31 +6,47 @@ Serialise ASCII as seven bits.
 Yes, I threw up a bit too.
 """
 
-from bitarray import bitarray
+import struct
+
+# Eight characters pack into exactly seven bytes, so text is handled as
+# big-endian 64-bit words, each squeezed down to 56 bits (or spread back out)
+# by moving ever larger groups of bits in three shift-and-mask steps.
+
+def squeeze(word):
+  "Pack the low seven bits of each byte of a 64-bit word into 56 bits."
+  word = word & 0x007f007f007f007f | (word & 0x7f007f007f007f00) >> 1
+  word = word & 0x00003fff00003fff | (word & 0x3fff00003fff0000) >> 2
+  return word & 0x000000000fffffff | (word & 0x0fffffff00000000) >> 4
+
+def spread(word):
+  "Undo squeeze(), leaving the top bit of each byte clear."
+  word = word & 0x000000000fffffff | (word << 4) & 0x0fffffff00000000
+  word = word & 0x00003fff00003fff | (word << 2) & 0x3fff00003fff0000
+  return word & 0x007f007f007f007f | (word << 1) & 0x7f007f007f007f00
 
 def encode(text):
-  ba = bitarray()
-  out = bitarray()
-  ba.fromstring(text)
-  s = 0
-  while s < len(ba):
-    byte = ba[s:s+8]
-    out.extend(byte[1:8])
-    s += 8
-#  print out
-  return out.tobytes()
+  size = len(text)
+  data = bytes(text) + b"\0" * (-size % 8)
+  count = len(data) // 8
+  words = struct.unpack(">%dQ" % count, data)
+  out = bytearray(struct.pack(">%dQ" % count, *[squeeze(w) for w in words]))
+  # the top byte of each word is now empty
+  del out[::8]
+  return bytes(out[:(size * 7 + 7) // 8])
 
 def decode(bits):
-  ba = bitarray()
-  out = bitarray()
-  ba.frombytes(bits)
-  s = 0
-  while s < len(ba):
-    seven = ba[s:s+7]
-    out.append(0)
-    out.extend(seven)
-    s += 7
-  return out.tostring()[:-1].encode('ascii')
+  # The length isn't sent: every seven bits, counting a short run at the
+  # end, make a character, and the last one is taken to be padding.
+  size = max((len(bits) * 8 + 6) // 7 - 1, 0)
+  data = bytearray(bits)
+  count = (len(data) + 6) // 7
+  data += b"\0" * (count * 7 - len(data))
+  padded = bytearray(count * 8)
+  for i in range(7):
+    padded[i+1::8] = data[i::7]
+  words = struct.unpack(">%dQ" % count, bytes(padded))
+  out = struct.pack(">%dQ" % count, *[spread(w) for w in words])
+  return out[:size]
 	
 
 if __name__ == "__main__":
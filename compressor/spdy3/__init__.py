@@ -4,46 +4,48 @@
 
 import zlib
 import struct
-from .. import spdy_dictionary, BaseProcessor
+from .. import spdy_dictionary, BaseProcessor, primed_compressor
 
 class Processor(BaseProcessor):
   def __init__(self, options, is_request, params):
     BaseProcessor.__init__(self, options, is_request, params)
-    self.compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION,
-                                       zlib.DEFLATED, 15)
     if 'dict' in params:
-      self.compressor.compress(spdy_dictionary.spdy_dict);
-      self.compressor.flush(zlib.Z_SYNC_FLUSH)
+      self.compressor = primed_compressor(
+        dictionary=spdy_dictionary.spdy_dict)
+    else:
+      self.compressor = primed_compressor()
+    self.out_frame = bytearray()
 
   def compress(self, in_headers, host):
     raw_spdy3_frame = self.Spdy3HeadersFormat(in_headers)
-    compress_me_payload = raw_spdy3_frame[12:]
-    final_frame = raw_spdy3_frame[:12]
-    final_frame += self.compressor.compress(compress_me_payload)
-    final_frame += self.compressor.flush(zlib.Z_SYNC_FLUSH)
+    # The first 12 bytes (where the frame header would be) are left
+    # uncompressed.
+    with memoryview(raw_spdy3_frame) as frame_view:
+      final_frame = b''.join([
+        frame_view[:12],
+        self.compressor.compress(frame_view[12:]),
+        self.compressor.flush(zlib.Z_SYNC_FLUSH)
+      ])
     return final_frame
 
   def Spdy3HeadersFormat(self, request):
     """
-    Formats the provided headers in SPDY3 format, uncompressed
+    Formats the provided headers in SPDY3 format, uncompressed.
+
+    The frame is built in a bytearray that is reused by the next call.
     """
-    out_frame = []
-    frame_len = 0
-    for (key, val) in request.items():
-      frame_len += 4
-      frame_len += len(key)
-      frame_len += 4
-      frame_len += len(val)
-    stream_id = 1
-    num_kv_pairs = len(list(request.keys()))
-#    out_frame.append(struct.pack('!L', 0x1 << 31 | 0x11 << 15 | 0x8))
-#    out_frame.append(struct.pack('!L', frame_len))
-#    out_frame.append(struct.pack('!L', stream_id))
-#    out_frame.append(struct.pack('!L', num_kv_pairs))
+    out_frame = self.out_frame
+    del out_frame[:]
+#    out_frame += LENGTH.pack(0x1 << 31 | 0x11 << 15 | 0x8)
+#    out_frame += LENGTH.pack(frame_len)
+#    out_frame += LENGTH.pack(stream_id)
+#    out_frame += LENGTH.pack(len(request))
     for (key, val) in request.items():
-      out_frame.append(struct.pack('!L', len(key)))
-      out_frame.append(key.encode('ascii'))
-      out_frame.append(struct.pack('!L', len(val)))
-      out_frame.append(val.encode('ascii'))
-    return b''.join(out_frame)
+      out_frame += LENGTH.pack(len(key))
+      out_frame += key.encode('ascii')
+      out_frame += LENGTH.pack(len(val))
+      out_frame += val.encode('ascii')
+    return out_frame
+
 
+LENGTH = struct.Struct('!L')
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+"""
+Prefixed integer coding shared by the HPACK-style codecs (see Section 4.1.1
+of draft-ietf-httpbis-header-compression).
+
+An integer starts in the low prefix_bits bits of its first byte; if it doesn't
+fit, those bits are all set and the rest follows in seven-bit groups, least
+significant first, with the top bit set on every byte but the last. Prefixes
+of 9 to 16 bits span two bytes; a prefix of 0 bits means there is no prefix
+byte at all.
+
+Works on Python 2 and 3. The codecs are trusted to pass sensible prefix
+sizes, so nothing is checked beyond what is needed to avoid silently writing
+the wrong bytes.
+"""
+
+# pylint: disable=W0311
+
+import struct
+
+# MAX_PREFIX[n] is the largest value an n-bit prefix holds, and the value
+# that signals that more bytes follow.
+MAX_PREFIX = [(1 << n) - 1 for n in range(17)]
+
+# BYTES[b] is the single byte b, as the str (Python 2) or bytes (Python 3)
+# that the codecs build their output from.
+BYTES = [struct.pack("!B", b) for b in range(256)]
+
+
+def encode_integer(value, prefix_bits, first_byte=0):
+  """
+  Return the encoding of the non-negative integer value, with its prefix
+  OR'd into first_byte (the high byte, for prefixes over 8 bits).
+  """
+  if prefix_bits > 8:
+    return _encode_wide(value, prefix_bits, first_byte)
+  max_prefix = MAX_PREFIX[prefix_bits]
+  if 0 <= value < max_prefix:
+    return BYTES[first_byte | value]
+  rest = value - max_prefix
+  if 0 <= rest < 0x80:
+    if prefix_bits:
+      return BYTES[first_byte | max_prefix] + BYTES[rest]
+    return BYTES[rest]
+  if value < 0:
+    raise ValueError("Can only encode positive integers, got %s" % value)
+  if prefix_bits:
+    return BYTES[first_byte | max_prefix] + _encode_rest(rest)
+  return _encode_rest(rest)
+
+
+def _encode_wide(value, prefix_bits, first_byte):
+  "encode_integer() for prefixes of more than 8 bits."
+  max_prefix = MAX_PREFIX[prefix_bits]
+  if 0 <= value < max_prefix:
+    return BYTES[first_byte | value >> 8] + BYTES[value & 0xff]
+  if value < 0:
+    raise ValueError("Can only encode positive integers, got %s" % value)
+  return BYTES[first_byte | max_prefix >> 8] + BYTES[0xff] + \
+    _encode_rest(value - max_prefix)
+
+
+def _encode_rest(value):
+  "Encode what is left of a value after its prefix, in seven-bit groups."
+  out = []
+  while value >= 0x80:
+    out.append(value & 0x7f | 0x80)
+    value >>= 7
+  out.append(value)
+  return bytes(bytearray(out))
+
+
+def decode_integer(data, offset, prefix_bits):
+  """
+  Decode an integer whose first byte (the prefix byte, unless prefix_bits is
+  0) is data[offset]. data must index to ints: bytes on Python 3, or a
+  bytearray or memoryview. Returns the value and the offset just past it;
+  running off the end of data raises IndexError.
+  """
+  max_prefix = MAX_PREFIX[prefix_bits]
+  if prefix_bits > 8:
+    value = (data[offset] & max_prefix >> 8) << 8 | data[offset + 1]
+    offset += 2
+  elif prefix_bits:
+    value = data[offset] & max_prefix
+    offset += 1
+  else:
+    value = 0
+  if value < max_prefix:
+    return value, offset
+  shift = 0
+  while True:
+    byte = data[offset]
+    offset += 1
+    value += (byte & 0x7f) << shift
+    if byte < 0x80:
+      return value, offset
+    shift += 7
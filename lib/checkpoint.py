@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+"""
+Record the results of each session as it's finished, so that a run that
+dies part of the way through can be resumed without redoing them.
+"""
+
+# pylint: disable=W0311
+
+import json
+import os
+
+
+class Checkpoint(object):
+  """
+  A file of the results of finished sessions, one JSON object per line,
+  written as each session is finished.
+
+  Sessions are identified by their name, msg_type and how many sessions
+  with the same name and msg_type came before them, so resuming needs the
+  same input files and streamifier. Results are kept for each codec spec
+  (as given to -c); a session is only skipped when every codec in the run
+  has results for it, since codec state is reset for each session anyway.
+  """
+  def __init__(self, filename, options):
+    self.filename = filename
+    self.specs = options.processor_names
+    self.baseline = options.baseline
+    self.fields = options.fields
+    self.done = {}  # key -> record
+    self.seen = {}  # (name, msg_type) -> sessions so far
+    partial = False
+    if options.resume and os.path.exists(filename):
+      partial = self.load()
+    self.fh = open(filename, 'a' if options.resume else 'w', encoding='utf-8')
+    if partial:
+      self.fh.write("\n")
+
+  def load(self):
+    """
+    Read the results recorded so far. Returns True if the last line was cut
+    short (e.g., by a crash while it was being written).
+    """
+    fh = open(self.filename, encoding='utf-8')
+    text = fh.read()
+    fh.close()
+    for line in text.splitlines():
+      try:
+        record = json.loads(line)
+      except ValueError:
+        continue
+      self.done[tuple(record['key'])] = record
+    return bool(text) and not text.endswith("\n")
+
+  def next_key(self, session):
+    "Return the key for session, which is the next one in the run."
+    seen = (session.name, session.msg_type)
+    self.seen[seen] = self.seen.get(seen, 0) + 1
+    return (session.name, session.msg_type, self.seen[seen])
+
+  def restore(self, session, key):
+    """
+    If the session with key has been done with every codec in the run,
+    record its results in session (and its field sizes, if they're
+    wanted), and return True.
+    """
+    results = self.previous_results(session, key)
+    for spec in self.specs:
+      if spec not in results:
+        return False
+      if self.fields and 'fields' not in results[spec]:
+        return False
+    results = [results[spec] for spec in self.specs]
+    baseline_sizes = [result['sizes'] for result in results
+                      if result['name'] == self.baseline][0]
+    if self.fields:
+      session.field_sizes = {}
+    for result in results:
+      proc = result['name']
+      for size, time, baseline_size in zip(result['sizes'], result['times'],
+                                           baseline_sizes):
+        if proc == self.baseline:
+          ratio = 1.0
+        else:
+          ratio = 1.0 * size / baseline_size
+        session.record_result(proc, size, ratio, time)
+      if self.fields:
+        for name, size in result['fields'].items():
+          session.field_sizes.setdefault(name, {})[proc] = size
+    return True
+
+  def save(self, session, key):
+    """
+    Record the results of session, which has just been processed, along
+    with any earlier results for it from codecs that aren't in this run.
+    """
+    results = self.previous_results(session, key)
+    for spec, proc in zip(self.specs, session.procs):
+      result = {
+        'name': proc,
+        'sizes': session.sizes[proc],
+        'times': session.times[proc],
+      }
+      if session.field_sizes is not None:
+        result['fields'] = dict((name, sizes[proc])
+                                for name, sizes in session.field_sizes.items()
+                                if proc in sizes)
+      results[spec] = result
+    record = {
+      'key': list(key),
+      'messages': len(session.messages),
+      'results': results,
+    }
+    self.done[key] = record
+    self.fh.write(json.dumps(record, sort_keys=True))
+    self.fh.write("\n")
+    self.fh.flush()
+
+  def previous_results(self, session, key):
+    """
+    Return the results recorded for key (codec spec -> result), as long as
+    they're for as many messages as session has.
+    """
+    record = self.done.get(key)
+    if record is None or record['messages'] != len(session.messages):
+      return {}
+    return dict(record['results'])
+
+  def close(self):
+    self.fh.close()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+
+"""
+Keep a corpus of messages compactly.
+
+Header names and values repeat a great deal, so each distinct string is
+stored once, in a symbol table, and each message is just an array of ids.
+"""
+
+# pylint: disable=W0311
+
+from array import array
+from collections.abc import Mapping
+
+from .harfile import Exchange, read_har_exchanges, read_jsonl_exchanges
+
+# Input formats, and the functions that read them.
+READERS = {
+  'har': read_har_exchanges,
+  'jsonl': read_jsonl_exchanges,
+}
+COMPRESSED_EXTS = ('.gz', '.zst', '.zstd')
+JSONL_EXTS = ('.jsonl', '.ndjson')
+
+
+class SymbolTable(object):
+  """
+  Gives each distinct string a small integer id.
+  """
+  def __init__(self):
+    self.ids = {}
+    self.strings = []
+
+  def intern(self, string):
+    "Return the id for string, adding it to the table if it's new."
+    try:
+      return self.ids[string]
+    except KeyError:
+      sym_id = self.ids[string] = len(self.strings)
+      self.strings.append(string)
+      return sym_id
+
+  def __len__(self):
+    return len(self.strings)
+
+
+class Message(Mapping):
+  """
+  A read-only header dictionary, as described in compressor.BaseProcessor,
+  stored as an array of alternating name and value ids. Use dict() (or
+  items()) to get the real thing.
+  """
+  __slots__ = ('symbols', 'fields')
+
+  def __init__(self, symbols, fields):
+    self.symbols = symbols
+    self.fields = fields
+
+  def __getitem__(self, name):
+    name_id = self.symbols.ids.get(name)
+    if name_id is not None:
+      fields = self.fields
+      for i in range(0, len(fields), 2):
+        if fields[i] == name_id:
+          return self.symbols.strings[fields[i + 1]]
+    raise KeyError(name)
+
+  def __iter__(self):
+    strings = self.symbols.strings
+    return (strings[name_id] for name_id in self.fields[::2])
+
+  def __len__(self):
+    return len(self.fields) // 2
+
+  def items(self):
+    strings = self.symbols.strings
+    fields = self.fields
+    return [(strings[fields[i]], strings[fields[i + 1]])
+            for i in range(0, len(fields), 2)]
+
+  def values(self):
+    strings = self.symbols.strings
+    return [strings[value_id] for value_id in self.fields[1::2]]
+
+  def __repr__(self):
+    return "Message(%r)" % dict(self.items())
+
+
+class Corpus(object):
+  """
+  The messages from any number of HAR files, sharing one symbol table.
+  """
+  def __init__(self):
+    self.symbols = SymbolTable()
+
+  def message(self, hdrs):
+    "Return a Message with the same headers as the dictionary hdrs."
+    intern = self.symbols.intern
+    fields = []
+    for name, value in hdrs.items():
+      fields.append(intern(name))
+      fields.append(intern(value))
+    return Message(self.symbols, array('I', fields))
+
+  def exchange(self, exchange):
+    "Return a copy of the Exchange exchange, with Messages for headers."
+    req, res = exchange
+    return Exchange(self.message(req), self.message(res), exchange.started,
+                    exchange.duration, exchange.connection)
+
+  def read_har_file(self, filename):
+    "Read filename and return a list of Exchanges, with Messages."
+    return self.read_file(filename, 'har')
+
+  def read_file(self, filename, input_format=None):
+    """
+    Read filename, in input_format ('har' or 'jsonl'; by default, guessed
+    from its name), and return a list of Exchanges, with Messages.
+    """
+    reader = READERS[input_format or guess_format(filename)]
+    return [self.exchange(exchange) for exchange in reader(filename)]
+
+
+def guess_format(filename):
+  "Guess the input format of filename from its extension(s)."
+  name = filename.lower()
+  for ext in COMPRESSED_EXTS:
+    if name.endswith(ext):
+      name = name[:-len(ext)]
+      break
+  if name.endswith(JSONL_EXTS):
+    return 'jsonl'
+  return 'har'
@@ -10,6 +10,9 @@ Utilities to get harfiles into the shape we want them to be.
 
 # pylint: disable=W0311
 
+import calendar
+import gzip
+import io
 import re
 import json
 import sys
@@ -17,7 +20,59 @@ from urllib.parse import urlsplit
 
 def read_har_file(filename):
   "Read filename and return the header dictionaries for it."
-  fhandle = open(filename)
+  return har2hdrs(load_har_file(filename))
+
+
+def read_har_exchanges(filename):
+  "Read filename and return the Exchanges in it."
+  return har2exchanges(load_har_file(filename))
+
+
+def read_jsonl_exchanges(filename):
+  """
+  Read filename, a JSON Lines file with a HAR entry on each line, and
+  generate the Exchanges in it, a line at a time.
+  """
+  fhandle = open_input(filename)
+  try:
+    for line_num, line in enumerate(fhandle, 1):
+      if not line.strip():
+        continue
+      try:
+        exchange = entry2exchange(json.loads(line))
+      except Exception as oops:
+        sys.stderr.write("Unable to parse %s line %d\n\n" % (filename, line_num))
+        sys.stderr.write("%s\n" % oops)
+        sys.exit(1)
+      if exchange is not None:
+        yield exchange
+  finally:
+    fhandle.close()
+
+
+def open_input(filename):
+  """
+  Open filename for reading text, decompressing it on the fly if its name
+  ends in .gz, or .zst or .zstd (which needs the zstandard module).
+  """
+  lower = filename.lower()
+  if lower.endswith(".gz"):
+    return gzip.open(filename, 'rt', encoding='utf-8')
+  if lower.endswith((".zst", ".zstd")):
+    try:
+      import zstandard
+    except ImportError:
+      sys.stderr.write("Reading %s needs the zstandard module.\n" % filename)
+      sys.exit(1)
+    reader = zstandard.ZstdDecompressor().stream_reader(open(filename, 'rb'),
+                                                        closefd=True)
+    return io.TextIOWrapper(io.BufferedReader(reader), encoding='utf-8')
+  return open(filename, encoding='utf-8')
+
+
+def load_har_file(filename):
+  "Read filename and return the HAR structure in it."
+  fhandle = open_input(filename)
   try:
     har = json.loads(fhandle.read())
   except Exception as oops:
@@ -26,7 +81,23 @@ def read_har_file(filename):
     sys.exit(1)
   finally: 
     fhandle.close()
-  return har2hdrs(har)
+  return har
+
+
+class Exchange(tuple):
+  """
+  A (request headers, response headers) pair, along with what the HAR says
+  about when and where it happened:
+   - started: when the request started, in seconds since the epoch (or None)
+   - duration: how long the exchange took, in seconds
+   - connection: the HAR's id for the connection it used (or None)
+  """
+  def __new__(cls, req, res, started=None, duration=0, connection=None):
+    self = tuple.__new__(cls, (req, res))
+    self.started = started
+    self.duration = duration
+    self.connection = connection
+    return self
 
 
 def har2hdrs(har):
@@ -36,38 +107,96 @@ def har2hdrs(har):
   
   Headers derived from other information are preceded by a ":" character.
   """
-  request_headers = []
-  response_headers = []
+  exchanges = har2exchanges(har)
+  return ([exchange[0] for exchange in exchanges],
+          [exchange[1] for exchange in exchanges])
+
+
+def har2exchanges(har):
+  """
+  Convert a har dictionary to a list of Exchanges, in file order.
+  """
+  exchanges = []
   for entry in har["log"]["entries"]:
-    request = entry["request"]
-    url = urlsplit(request["url"])
-    if not url.scheme.lower() in ["http", "https"]:
-      continue
-    headers = process_headers(request["headers"])
-    headers[":method"] = request["method"].lower()
-    headers[":path"] = url.path
-    if url.query:
-      headers[":path"] += "?%s" % url.query
-    headers[":scheme"] = url.scheme.lower()
-    headers[":version"] = request["httpVersion"]
-    if not ":host" in request_headers:
-      headers[":host"] = re.sub("^[^:]*://([^/]*)/.*$", "\\1", request["url"])
-    request_headers.append(headers)
-
-    response = entry["response"]
-    headers = process_headers(response["headers"])
-    headers[":status"] = re.sub("^([0-9]*).*", "\\1", str(response["status"]))
-    headers[":status-text"] = response["statusText"].strip() or \
-      STATUS_PHRASES.get(headers[':status'], 'unknown')
-    headers[":version"] = response["httpVersion"]
-    response_headers.append(headers)
-
-  return (request_headers, response_headers)
+    exchange = entry2exchange(entry)
+    if exchange is not None:
+      exchanges.append(exchange)
+  return exchanges
+
+
+def entry2exchange(entry):
+  """
+  Convert a HAR entry to an Exchange, or None if it isn't HTTP. As well as
+  HAR's lists, headers can be an object of names to values (or lists of
+  values); httpVersion and statusText are optional.
+  """
+  request = entry["request"]
+  url = urlsplit(request["url"])
+  if not url.scheme.lower() in ["http", "https"]:
+    return None
+  headers = process_headers(request["headers"])
+  headers[":method"] = request["method"].lower()
+  headers[":path"] = url.path
+  if url.query:
+    headers[":path"] += "?%s" % url.query
+  headers[":scheme"] = url.scheme.lower()
+  headers[":version"] = request.get("httpVersion", "HTTP/1.1")
+  headers[":host"] = re.sub("^[^:]*://([^/]*)/.*$", "\\1", request["url"])
+  req_headers = headers
+
+  response = entry["response"]
+  headers = process_headers(response["headers"])
+  headers[":status"] = re.sub("^([0-9]*).*", "\\1", str(response["status"]))
+  headers[":status-text"] = response.get("statusText", "").strip() or \
+    STATUS_PHRASES.get(headers[':status'], 'unknown')
+  headers[":version"] = response.get("httpVersion", "HTTP/1.1")
+
+  return Exchange(req_headers, headers,
+                  parse_iso_date(entry.get("startedDateTime")),
+                  entry_duration(entry),
+                  entry.get("connection") or None)
+
+ISO_DATE = re.compile(
+  r"(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d)(?::(\d\d)(\.\d+)?)?"
+  r"(Z|[+-]\d\d:?\d\d)?$")
+
+def parse_iso_date(value):
+  """
+  Parse an ISO 8601 date-time, as used for startedDateTime, and return it as
+  seconds since the epoch; None if it's missing or bad. No zone means UTC.
+  """
+  match = value and ISO_DATE.match(value.strip())
+  if not match:
+    return None
+  year, month, day, hour, minute, second, fraction, zone = match.groups()
+  try:
+    date = calendar.timegm((int(year), int(month), int(day), int(hour),
+                            int(minute), int(second or 0), 0, 0, 0))
+  except ValueError:
+    return None
+  if fraction:
+    date += float(fraction)
+  if zone and zone != "Z":
+    offset = int(zone[1:3]) * 3600 + int(zone[-2:]) * 60
+    date += -offset if zone[0] == "+" else offset
+  return date
+
+def entry_duration(entry):
+  "How long a HAR entry took, in seconds."
+  total = entry.get("time")
+  if total is None or total < 0:
+    total = sum(t for t in entry.get("timings", {}).values()
+                if isinstance(t, (int, float)) and t > 0)
+  return total / 1000.0
 
 
 def process_headers(hdrdicts):
   "Take a har header datastructure and return a normalised dictionary."
   out = {}
+  if isinstance(hdrdicts, dict):
+    hdrdicts = [{"name": name, "value": value}
+                for name, values in hdrdicts.items()
+                for value in (values if isinstance(values, list) else [values])]
   for hdrdict in hdrdicts:
     name = hdrdict["name"].lower()
     val = hdrdict["value"]
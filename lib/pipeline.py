@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+"""
+Run each codec in its own worker process, so that a run takes about as
+long as its slowest codec, rather than as long as all of them together.
+"""
+
+# pylint: disable=W0311
+
+from collections import defaultdict
+from multiprocessing import Pipe, Process
+import pickle
+import sys
+
+from .processors import Processors
+
+
+class Pipeline(Processors):
+  """
+  Processors, with one long-lived worker process per codec. Each session's
+  messages are serialised once and sent to every worker down a pipe; the
+  workers compress them at the same time, and send back their sizes and
+  times.
+
+  Codecs' output (e.g., with -v) is written by the workers, so it can be
+  interleaved.
+  """
+  def __init__(self, options, msg_types, output):
+    self.options = options
+    self.msg_types = msg_types
+    self.output = output
+    self.field_sizes = dict(
+      (msg_type, defaultdict(lambda: defaultdict(int)))
+      for msg_type in msg_types)
+    sys.stdout.flush()
+    self.workers = []
+    for spec in options.processor_names:
+      conn, child_conn = Pipe()
+      process = Process(target=run_worker,
+                        args=(child_conn, options, msg_types, spec))
+      process.daemon = True  # so an exit doesn't wait for the others
+      process.start()
+      child_conn.close()
+      self.workers.append((spec, process, conn))
+    self._names = []
+    for spec, process, conn in self.workers:
+      self._names.extend(self.receive(spec, conn))
+
+  def names(self):
+    return self._names
+
+  def process_session(self, session):
+    """
+    Process the messages in the session in every worker, and record
+    results.
+    """
+    payload = pickle.dumps(
+      (session.msg_type,
+       [(list(hdrs.items()), host) for (hdrs, host) in session.messages]),
+      pickle.HIGHEST_PROTOCOL)
+    for spec, process, conn in self.workers:
+      conn.send_bytes(payload)
+    results = {}
+    field_sizes = {}
+    for spec, process, conn in self.workers:
+      worker_results, worker_field_sizes = self.receive(spec, conn)
+      results.update(worker_results)
+      for name, sizes in (worker_field_sizes or {}).items():
+        field_sizes.setdefault(name, {}).update(sizes)
+    self.record_results(session, results)
+    if self.options.fields:
+      session.field_sizes = field_sizes
+      self.add_field_sizes(session.msg_type, field_sizes)
+
+  @staticmethod
+  def receive(spec, conn):
+    "Receive the next thing from the worker for spec; exit if it's died."
+    try:
+      return conn.recv()
+    except EOFError:
+      sys.stderr.write("The worker for %s stopped.\n" % spec)
+      sys.exit(1)
+
+  def done(self):
+    for spec, process, conn in self.workers:
+      try:
+        conn.send_bytes(b"")
+      except (EOFError, OSError):
+        pass
+    for spec, process, conn in self.workers:
+      process.join()
+      conn.close()
+
+
+def run_worker(conn, options, msg_types, spec):
+  """
+  The body of a worker process: compress each session the parent sends
+  with the codec spec, and send back the results, until it sends nothing.
+  """
+  options.processor_names = [spec]
+  processors = Processors(options, msg_types, sys.stdout.write)
+  conn.send(processors.names())
+  while True:
+    payload = conn.recv_bytes()
+    if not payload:
+      break
+    msg_type, messages = pickle.loads(payload)
+    results = processors.compress_session(
+      msg_type, [(dict(items), host) for (items, host) in messages])
+    field_sizes = None
+    if options.fields:
+      field_sizes = processors.take_field_sizes(msg_type)
+    sys.stdout.flush()
+    conn.send((results, field_sizes))
+  processors.done()
+  conn.close()
@@ -5,26 +5,39 @@ from copy import copy
 from importlib import import_module
 import os
 import sys
-from compressor import format_http1
+from compressor import SharedHeaders, format_http1
 
 # pylint: disable=W0311
 
+# Headers that aren't given to the processors at all.
+FILTERED_HDRS = frozenset([':status-text', ':version', 'keep-alive',
+                           'connection'])
+
+# Headers that don't have to survive a round trip.
+COMPARE_IGNORES = frozenset([':version', ':status-text', 'connection'])
+
+def normalize_headers(d, ignores):
+  """
+  Turn a header dictionary into a set of (name, value) pairs, with
+  multiple values (and cookies) split out.
+  """
+  nd = set()
+  for k,v in d.items():
+    if k in ignores:
+      continue
+    if k == 'cookie':
+      splitlist = set([x.strip(' ') for x in v.split(';')])
+    else:
+      splitlist = set([x.strip(' ') for x in v.split('\0')])
+    for item in splitlist:
+      nd.add( (k, item) )
+  return nd
+
 def compare_headers_impl(a_input, b_input, ignores):
-  def NormalizeDict(d):
-    nd = set()
-    for k,v in d.items():
-      if k in ignores:
-        continue
-      if k == 'cookie':
-        splitlist = set([x.strip(' ') for x in v.split(';')])
-      else:
-        splitlist = set([x.strip(' ') for x in v.split('\0')])
-      for item in splitlist:
-        nd.add( (k, item) )
-    return nd
+  return compare_normalized(normalize_headers(a_input, ignores),
+                            normalize_headers(b_input, ignores))
 
-  a_hdr = NormalizeDict(a_input)
-  b_hdr = NormalizeDict(b_input)
+def compare_normalized(a_hdr, b_hdr):
   retval = {'a_only': a_hdr.difference(b_hdr),
             'shared': a_hdr.intersection(b_hdr),
             'b_only': b_hdr.difference(a_hdr)}
@@ -43,6 +56,10 @@ class Processors(object):
     self.output = output
     self.warned = {'http1_gzip': True}  # procs with no decompress support
     self.processors = self.get_processors(options.processor_names)
+    # msg_type -> header name -> processor name -> bytes
+    self.field_sizes = dict(
+      (msg_type, defaultdict(lambda: defaultdict(int)))
+      for msg_type in msg_types)
 
   def get_processors(self, processor_names):
     """
@@ -63,31 +80,84 @@ class Processors(object):
       procs['res'].append(module.Processor(self.options, False, params))
     return procs
 
+  def names(self):
+    "Return the names of the processors, in order."
+    return [p.name for p in self.processors['req']]
+
   def process_session(self, session):
     """
     Process the messages in the session with all processors, and record
     results.
     """
+    results = self.compress_session(session.msg_type, session.messages)
+    self.record_results(session, results)
+    if self.options.fields:
+      session.field_sizes = self.take_field_sizes(session.msg_type)
+      self.add_field_sizes(session.msg_type, session.field_sizes)
+
+  def compress_session(self, msg_type, messages):
+    """
+    Process messages, a list of (hdrs, host), with fresh processors of
+    msg_type. Returns a dictionary of processor names mapped to lists of
+    the sizes and times for each message.
+    """
     msg_idx = 0
-    msg_tot = len(session.messages)
+    msg_tot = len(messages)
     self.processors = self.get_processors(self.options.processor_names)
-    for (hdrs, host) in session.messages:
+    out = dict((processor.name, {'sizes': [], 'times': []})
+               for processor in self.processors[msg_type])
+    for (hdrs, host) in messages:
       msg_idx += 1
-      results = self.process_message(hdrs, session.msg_type,
-                                     host, msg_idx, msg_tot)
-      for proc_name, resu in list(results.items()):
+      results = self.process_message(hdrs, msg_type, host, msg_idx, msg_tot)
+      for proc_name, resu in results.items():
+        out[proc_name]['sizes'].append(resu['size'])
+        out[proc_name]['times'].append(resu['time'])
+    return out
+
+  def record_results(self, session, results):
+    """
+    Record results from compress_session() in session, with the ratio of
+    each size to the baseline's.
+    """
+    baseline_sizes = results[self.options.baseline]['sizes']
+    for proc_name, resu in results.items():
+      for size, time, baseline_size in zip(resu['sizes'], resu['times'],
+                                           baseline_sizes):
         if proc_name == self.options.baseline:
           ratio = 1.0
         else:
-          ratio = 1.0 * resu['size'] / results[self.options.baseline]['size']
-        session.record_result(proc_name, resu['size'], ratio, resu['time'])
+          ratio = 1.0 * size / baseline_size
+        session.record_result(proc_name, size, ratio, time)
+
+  def take_field_sizes(self, msg_type):
+    """
+    Return the per-header-field sizes the processors of msg_type have
+    recorded (header name -> processor name -> bytes), and clear them.
+    """
+    sizes = {}
+    for processor in self.processors[msg_type]:
+      for name, size in processor.field_sizes.items():
+        sizes.setdefault(name, {})[processor.name] = size
+      processor.field_sizes.clear()
+    return sizes
+
+  def add_field_sizes(self, msg_type, sizes):
+    """
+    Add sizes (header name -> processor name -> bytes) to the running
+    totals for msg_type.
+    """
+    totals = self.field_sizes[msg_type]
+    for name, proc_sizes in sizes.items():
+      for proc_name, size in proc_sizes.items():
+        totals[name][proc_name] += size
 
   @staticmethod
   def filter_headers(hdrs):
-    new_hdrs = {}
-    ignore_hdrs = [':status-text', ':version', 'keep-alive', 'connection']
+    new_hdrs = SharedHeaders()
+    ignore_hdrs = FILTERED_HDRS
     if 'connection' in hdrs:
-      ignore_hdrs.extend([x.strip(' ') for x in hdrs['connection'].split(',')])
+      ignore_hdrs = ignore_hdrs.union(
+        [x.strip(' ') for x in hdrs['connection'].split(',')])
 
     for k,v in hdrs.items():
       if k in ignore_hdrs:
@@ -95,6 +165,18 @@ class Processors(object):
       new_hdrs[k] = v
     return new_hdrs
 
+  @staticmethod
+  def prepare_message(hdrs):
+    """
+    Do the work on a message that doesn't depend on the processor, once for
+    all of them. Returns the filtered headers to give every processor (their
+    HTTP/1 serialisation already made), and the set to compare what they
+    decompress to.
+    """
+    filtered_hdrs = Processors.filter_headers(hdrs)
+    format_http1(filtered_hdrs)
+    return filtered_hdrs, normalize_headers(filtered_hdrs, COMPARE_IGNORES)
+
   def process_message(self, hdrs, msg_type, host, msg_idx, msg_tot):
     """
     message is a HTTP header dictionary in the format described in
@@ -110,6 +192,7 @@ class Processors(object):
       self.output('#' * 80)
       self.output('\n')
     results = {}
+    filtered_hdrs, normalized_hdrs = self.prepare_message(hdrs)
     for processor in self.processors[msg_type]:
       if self.options.verbose >= 3:
         self.output("# %s %s %d (of %d) for %s\n" %
@@ -119,8 +202,6 @@ class Processors(object):
              msg_tot,
              host))
       start_time = sum(os.times()[:2])
-      filtered_hdrs = Processors.filter_headers(hdrs)
-
       compressed = processor.compress(filtered_hdrs, host)
       results[processor.name] = {
         'size': len(compressed),
@@ -146,8 +227,10 @@ class Processors(object):
         self.output("%s" % txt)
         if not txt or txt[-1] != "\n":
           self.output("\n\n")
-      compare_result = self.compare_headers(filtered_hdrs, "orig",
-                                            decompressed, processor.name)
+      compare_result = self.describe_differences(
+        normalized_hdrs, "orig",
+        normalize_headers(dict(decompressed), COMPARE_IGNORES),
+        processor.name)
       if compare_result:
         self.output('  - mismatch in %s' % processor.name)
         if self.options.verbose > 1:
@@ -177,10 +260,19 @@ class Processors(object):
     If nothing is different, it returns an empty string. If it is, it
     returns a string explaining what is different.
     """
-    ignores = [':version', ':status-text', 'connection']
     a_hdr = dict(a_hdr)
     b_hdr = dict(b_hdr)
-    compare_result = compare_headers_impl(a_hdr, b_hdr, ignores)
+    return Processors.describe_differences(
+      normalize_headers(a_hdr, COMPARE_IGNORES), a_name,
+      normalize_headers(b_hdr, COMPARE_IGNORES), b_name)
+
+  @staticmethod
+  def describe_differences(a_hdr, a_name, b_hdr, b_name):
+    """
+    compare_headers() for headers that have already been through
+    normalize_headers().
+    """
+    compare_result = compare_normalized(a_hdr, b_hdr)
     retval = []
     if compare_result['a_only']:
       retval.append('Only found in: %s' % a_name)
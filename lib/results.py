@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+
+"""
+Write out the per-message results of each stream as soon as it's done.
+"""
+
+# pylint: disable=W0311
+
+import json
+import os
+
+# Bytes of output to buffer before writing.
+BUFFER_SIZE = 1 << 16
+
+# The most points per processor in a TSV summary.
+SUMMARY_POINTS = 2000
+
+
+class ResultsWriter(object):
+  """
+  Writes the results of Streams as TSV (<prefix>req.tsv and <prefix>res.tsv,
+  which display_tsv.html shows) and/or newline-delimited JSON
+  (<prefix>results.ndjson, a line per message with each processor's size
+  and time). Everything written is flushed after each Stream, so if a run
+  is interrupted, the results so far are there.
+
+  Each TSV file also gets a TsvSummary, written alongside it on close();
+  counts gives the number of messages of each msg_type to expect, so that
+  it can be sized.
+  """
+  def __init__(self, prefix, msg_types, procs, tsv=True, ndjson=False,
+               counts=None):
+    self.procs = procs
+    self.tsv_out = {}  # msg_type -> TsvOut
+    self.ndjson_out = None
+    self.ndjson_count = dict((msg_type, 0) for msg_type in msg_types)
+    counts = counts or {}
+    if tsv:
+      for msg_type in msg_types:
+        self.tsv_out[msg_type] = TsvOut("%s%s.tsv" % (prefix, msg_type),
+                                        procs, counts.get(msg_type, 0))
+    if ndjson:
+      self.ndjson_out = open("%sresults.ndjson" % prefix, 'w',
+                             buffering=BUFFER_SIZE)
+
+  def write(self, stream):
+    "Write the results recorded in stream."
+    if stream.msg_type in self.tsv_out:
+      self.tsv_out[stream.msg_type].write(stream)
+    if self.ndjson_out:
+      self.write_ndjson(stream)
+      self.ndjson_out.flush()
+
+  def write_ndjson(self, stream):
+    "Write a JSON object for each message in stream."
+    count = self.ndjson_count[stream.msg_type]
+    sizes = [stream.sizes[proc] for proc in self.procs]
+    times = [stream.times[proc] for proc in self.procs]
+    write = self.ndjson_out.write
+    for idx in range(len(sizes[0]) if sizes else 0):
+      count += 1
+      write(json.dumps({
+        'type': stream.msg_type,
+        'num': count,
+        'stream': stream.name,
+        'sizes': dict(zip(self.procs, [size[idx] for size in sizes])),
+        'times': dict(zip(self.procs, [time[idx] for time in times])),
+      }, sort_keys=True))
+      write("\n")
+    self.ndjson_count[stream.msg_type] = count
+
+  def close(self):
+    for tsv_out in self.tsv_out.values():
+      tsv_out.close()
+    if self.ndjson_out:
+      self.ndjson_out.close()
+
+
+class TsvOut(object):
+  """
+  A TSV file of results, as Stream.print_tsv writes them, and its summary.
+  """
+  def __init__(self, filename, procs, count):
+    self.filename = filename
+    self.procs = procs
+    self.count = 0
+    self.fh = open(filename, 'w', encoding='utf-8', buffering=BUFFER_SIZE)
+    self.offset = 0  # bytes written so far
+    self.line_starts = []  # offsets of the lines in the current write()
+    self.at_line_start = True
+    self.summary = TsvSummary(os.path.basename(filename), procs, count)
+
+  def write(self, stream):
+    "Write the results recorded in stream."
+    if not self.offset:
+      stream.print_tsv_header(self.output)
+    rows = list(zip(*[stream.sizes[proc] for proc in self.procs]))
+    first = self.count + 1
+    self.summary.add_stream(stream.name, first, len(rows),
+                            [sum(stream.sizes[proc]) for proc in self.procs])
+    self.line_starts = []
+    self.count = stream.print_tsv(self.output, self.count)
+    for num, offset, row in zip(range(first, self.count + 1),
+                                self.line_starts, rows):
+      self.summary.add(num, offset, row)
+    self.fh.flush()
+
+  def output(self, text):
+    "Write text to the file, noting the offset of each line it starts."
+    if self.at_line_start:
+      self.line_starts.append(self.offset)
+    self.fh.write(text)
+    self.offset += len(text.encode('utf-8'))
+    self.at_line_start = text.endswith("\n")
+
+  def close(self):
+    self.fh.close()
+    summaryfh = open("%s.summary.json" % os.path.splitext(self.filename)[0],
+                     'w', encoding='utf-8')
+    json.dump(self.summary.as_json(self.offset), summaryfh)
+    summaryfh.close()
+
+
+class TsvSummary(object):
+  """
+  A view of a TSV file of results small enough to draw all of: the minimum,
+  maximum and mean size for each processor over buckets of bucket_size
+  messages, with the byte offset in the TSV of each bucket's first row (so
+  that a range of rows can be fetched), and the totals for each stream.
+  """
+  def __init__(self, tsv_name, procs, count):
+    self.tsv_name = tsv_name
+    self.procs = procs
+    self.count = 0
+    self.bucket_size = max(1, -(-count // SUMMARY_POINTS))
+    self.buckets = []
+    self.streams = []
+
+  def add_stream(self, name, first, count, sizes):
+    "Note a stream of count messages from number first, totalling sizes."
+    self.streams.append({'name': name, 'first': first, 'count': count,
+                         'sizes': sizes})
+
+  def add(self, num, offset, sizes):
+    "Add the row for message number num, which is at offset in the TSV."
+    self.count = num
+    if (num - 1) % self.bucket_size == 0:
+      self.buckets.append({'first': num, 'offset': offset, 'count': 1,
+                           'min': list(sizes), 'max': list(sizes),
+                           'sum': list(sizes)})
+      return
+    bucket = self.buckets[-1]
+    bucket['count'] += 1
+    mins, maxs, sums = bucket['min'], bucket['max'], bucket['sum']
+    for idx, size in enumerate(sizes):
+      if size < mins[idx]:
+        mins[idx] = size
+      elif size > maxs[idx]:
+        maxs[idx] = size
+      sums[idx] += size
+
+  def as_json(self, tsv_bytes):
+    "Return the summary as a JSON-able dict; tsv_bytes is the TSV's size."
+    buckets = []
+    for bucket in self.buckets:
+      buckets.append({
+        'first': bucket['first'],
+        'offset': bucket['offset'],
+        'count': bucket['count'],
+        'min': bucket['min'],
+        'max': bucket['max'],
+        'mean': [1.0 * total / bucket['count'] for total in bucket['sum']],
+      })
+    return {
+      'tsv': self.tsv_name,
+      'tsv_bytes': tsv_bytes,
+      'procs': self.procs,
+      'count': self.count,
+      'bucket_size': self.bucket_size,
+      'buckets': buckets,
+      'streams': self.streams,
+    }
@@ -22,6 +22,7 @@ class Stream(object):
     self.sizes = defaultdict(list)
     self.ratios = defaultdict(list)
     self.times = defaultdict(list)
+    self.field_sizes = None # header name -> proc -> bytes, with -f
 
   def record_result(self, proc_name, size, ratio, time):
     "Record the results of processing, by proc_name."
@@ -36,25 +37,15 @@ class Stream(object):
 
   def print_summary(self, output, baseline):
     "Print a summary of the stream to output, compared to baseline."
-    lines = []
-    baseline_size = sum(self.sizes[baseline])
+    rows = []
     for proc in self.procs:
-      ttl_size = sum(self.sizes[proc])
-      ttl_time = sum(self.times[proc])
-      pretty_size = locale.format("%13d", ttl_size, grouping=True)
-      ratio = 1.0 * ttl_size / baseline_size
       try:
         std = meanstdv(self.ratios[proc])[1]
       except ZeroDivisionError:
         std = 0
-      min_ratio = min(self.ratios[proc])
-      max_ratio = max(self.ratios[proc])
-      lines.append((proc, pretty_size, ttl_time, ratio, min_ratio, max_ratio, std))
-    output('  %%%ds size  time | ratio min   max   std\n' % (self.lname + 9) % '')
-    fmt = '  %%%ds %%s %%5.2f | %%2.2f  %%2.2f  %%2.2f  %%2.2f\n' % self.lname
-    for line in lines:
-      output(fmt % line)
-    output("\n")
+      rows.append((proc, sum(self.sizes[proc]), sum(self.times[proc]),
+                   min(self.ratios[proc]), max(self.ratios[proc]), std))
+    print_summary_table(output, self.lname, sum(self.sizes[baseline]), rows)
 
   def print_tsv_header(self, output):
     "Print a TSV header to output."
@@ -91,6 +82,94 @@ class Stream(object):
     return new
 
 
+class StreamTotals(object):
+  """
+  Running totals of the results of any number of Streams of one msg_type,
+  enough to print a summary like Stream's without keeping the results of
+  every message.
+  """
+  def __init__(self, name, msg_type, procs):
+    self.name = name
+    self.msg_type = msg_type
+    self.procs = procs
+    self.lname = max([len(p) for p in procs])
+    self.count = 0
+    self.sizes = defaultdict(int)
+    self.times = defaultdict(float)
+    self.ratios = defaultdict(RunningStats)
+
+  def add(self, stream):
+    "Add the results recorded in stream."
+    assert self.msg_type == stream.msg_type
+    self.count += len(stream.messages)
+    for proc in self.procs:
+      self.sizes[proc] += sum(stream.sizes[proc])
+      self.times[proc] += sum(stream.times[proc])
+      self.ratios[proc].extend(stream.ratios[proc])
+
+  def print_header(self, output):
+    "Print a header for the summary to output."
+    output("* %s: %i %s messages\n" % (self.name, self.count, self.msg_type))
+
+  def print_summary(self, output, baseline):
+    "Print a summary of the totals to output, compared to baseline."
+    rows = []
+    for proc in self.procs:
+      ratios = self.ratios[proc]
+      try:
+        std = ratios.stdv()
+      except ZeroDivisionError:
+        std = 0
+      rows.append((proc, self.sizes[proc], self.times[proc],
+                   ratios.min, ratios.max, std))
+    print_summary_table(output, self.lname, self.sizes[baseline], rows)
+
+
+class RunningStats(object):
+  """
+  The count, mean, standard deviation, minimum and maximum of a series of
+  numbers, updated as they arrive (using Welford's method).
+  """
+  def __init__(self):
+    self.num = 0
+    self.mean = 0.0
+    self.sq_diffs = 0.0
+    self.min = None
+    self.max = None
+
+  def extend(self, members):
+    "Add members to the series."
+    for item in members:
+      self.num += 1
+      delta = item - self.mean
+      self.mean += delta / self.num
+      self.sq_diffs += delta * (item - self.mean)
+      if self.min is None or item < self.min:
+        self.min = item
+      if self.max is None or item > self.max:
+        self.max = item
+
+  def stdv(self):
+    "The standard deviation, as meanstdv() calculates it."
+    from math import sqrt
+    return sqrt(self.sq_diffs / float(self.num - 1))
+
+
+def print_summary_table(output, lname, baseline_size, rows):
+  """
+  Print a summary to output; rows are (proc, total size, total time,
+  min ratio, max ratio, std of ratios). lname is the longest proc name.
+  """
+  output('  %%%ds size  time | ratio min   max   std\n' % (lname + 9) % '')
+  fmt = '  %%%ds %%s %%5.2f | %%2.2f  %%2.2f  %%2.2f  %%2.2f\n' % lname
+  for proc, ttl_size, ttl_time, min_ratio, max_ratio, std in rows:
+    pretty_size = locale.format("%13d", ttl_size, grouping=True)
+    ratio = 1.0 * ttl_size / baseline_size
+    output(fmt % (proc, pretty_size, ttl_time, ratio, min_ratio, max_ratio,
+                  std))
+  output("\n")
+
+
 def merge_dols(dol1, dol2):
   """
   Merge two dictionaries of lists.
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+from collections import OrderedDict
+
+from . import BaseStreamifier, Stream
+
+class Streamifier(BaseStreamifier):
+  """
+  Split the messages into streams, one per direction per connection, in
+  the order that they started.
+
+  Connections are taken from the HAR's connection ids when it has them.
+  Otherwise, each origin (scheme and host) is assumed to have one connection
+  at a time, which is replaced when it has been idle for more than
+  idle_timeout seconds; i.e., what HTTP/2 would do.
+  """
+  idle_timeout = 300
+
+  def streamify(self, messages):
+    """
+    Given a list of messages (each a req, res tuple), return a list of
+    Stream objects.
+    """
+    streams = OrderedDict()  # connection -> (name, reqs, ress)
+    origins = {}  # origin -> [connection, count, idle since]
+    for started, duration, conn_id, req, res in self.timeline(messages):
+      host = req[':host']
+      if conn_id is not None:
+        conn = conn_id
+        name = "%s #%s" % (host, conn_id)
+      else:
+        origin = "%s://%s" % (req.get(':scheme', 'http'), host.lower())
+        state = origins.get(origin)
+        if state is None:
+          state = origins[origin] = [None, 0, None]
+        idle_since = state[2]
+        if state[0] is None or (started is not None and idle_since is not None
+                                and started - idle_since > self.idle_timeout):
+          state[1] += 1
+          state[0] = (origin, state[1])
+        conn = state[0]
+        name = "%s (%d)" % (origin, state[1])
+        if started is not None:
+          ended = started + duration
+          if idle_since is None or ended > idle_since:
+            state[2] = ended
+      try:
+        reqs, ress = streams[conn][1:]
+      except KeyError:
+        reqs, ress = [], []
+        streams[conn] = (name, reqs, ress)
+      reqs.append((req, host))
+      ress.append((res, host))
+
+    out = []
+    for name, reqs, ress in streams.values():
+      out.append(Stream(name, reqs, 'req', self.procs))
+      out.append(Stream(name, ress, 'res', self.procs))
+    return out
+
+  @staticmethod
+  def timeline(messages):
+    """
+    Return (started, duration, connection id, req, res) for each message,
+    ordered by when it started. Messages that don't say when they started
+    (e.g., plain tuples) stay just after the one before them.
+    """
+    entries = []
+    last_started = None
+    for idx, message in enumerate(messages):
+      req, res = message
+      started = getattr(message, 'started', None)
+      if started is not None:
+        last_started = started
+      if last_started is None:
+        sort_key = float('-inf')
+      else:
+        sort_key = last_started
+      entries.append((sort_key, idx, started, getattr(message, 'duration', 0),
+                      getattr(message, 'connection', None), req, res))
+    entries.sort(key=lambda entry: entry[:2])
+    return [entry[2:] for entry in entries]
@@ -1,10 +1,25 @@
 #!/usr/bin/env python
 
-from collections import defaultdict
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import tempfile
 
 from . import BaseStreamifier, Stream
 
-from publicsuffix import PublicSuffixList
+import publicsuffix
+
+# The list that comes with the publicsuffix module.
+PSL_FILE = os.path.join(os.path.dirname(publicsuffix.__file__),
+                        'public_suffix_list.dat')
+
+# Bump this when the layout of the compiled trie changes.
+TRIE_VERSION = 2
+
+# Compiled tries, by list filename.
+_tries = {}
+
 
 class Streamifier(BaseStreamifier):
   """
@@ -13,26 +28,169 @@ class Streamifier(BaseStreamifier):
   """
   def __init__(self, procs):
     BaseStreamifier.__init__(self, procs)
-    self.psl = PublicSuffixList()
+    self.trie = load_trie(PSL_FILE)
+    self.host_suffixes = {}
 
   def streamify(self, messages):
     """
     Given a list of messages (each a req, res tuple), return a list of
     Stream objects.
     """
-    reqs = defaultdict(list)
-    ress = defaultdict(list)
-    suffixes = []
+    host_suffixes = self.host_suffixes
+    groups = OrderedDict()  # suffix -> (reqs, ress)
     for req, res in messages:
       host = req[':host']
-      suffix = self.psl.get_public_suffix(host.split(":", 1)[0])
-      if suffix not in suffixes:
-        suffixes.append(suffix)
-      reqs[suffix].append((req, host))
-      ress[suffix].append((res, host))
+      try:
+        suffix = host_suffixes[host]
+      except KeyError:
+        suffix = host_suffixes[host] = get_public_suffix(
+          self.trie, host.split(":", 1)[0])
+      try:
+        reqs, ress = groups[suffix]
+      except KeyError:
+        reqs, ress = groups[suffix] = ([], [])
+      reqs.append((req, host))
+      ress.append((res, host))
 
     streams = []
-    for suffix in suffixes:
-      streams.append(Stream(suffix, reqs[suffix], 'req', self.procs))
-      streams.append(Stream(suffix, ress[suffix], 'res', self.procs))
-    return streams
\ No newline at end of file
+    for suffix, (reqs, ress) in groups.items():
+      streams.append(Stream(suffix, reqs, 'req', self.procs))
+      streams.append(Stream(suffix, ress, 'res', self.procs))
+    return streams
+
+
+def load_trie(filename):
+  """
+  Return the compiled trie for the public suffix list in filename. It is
+  cached on disk (as JSON, which turns the trie's tuples into lists) in a
+  directory only this user can write to, and only recompiled when the list
+  changes or the cache doesn't hold a well-formed trie.
+  """
+  if filename in _tries:
+    return _tries[filename]
+  stat = os.stat(filename)
+  key = hashlib.sha1(("%s %s %s %s" % (
+    TRIE_VERSION, os.path.abspath(filename), stat.st_size, stat.st_mtime)
+  ).encode('utf-8')).hexdigest()
+  cache_dir = get_cache_dir()
+  trie = None
+  if cache_dir is not None:
+    cache_file = os.path.join(cache_dir, "psl-%s.json" % key)
+    try:
+      with open(cache_file, encoding='utf-8') as fh:
+        trie = json.load(fh)
+      if not _valid_node(trie):
+        trie = None
+    except (IOError, OSError, ValueError, RecursionError):
+      trie = None
+  if trie is None:
+    with open(filename, encoding='utf-8') as fh:
+      trie = compile_trie(fh)
+    if cache_dir is not None:
+      save_trie(trie, cache_dir, cache_file)
+  _tries[filename] = trie
+  return trie
+
+def get_cache_dir():
+  """
+  Return a cache directory that only this user can write to, creating it
+  if need be; None if there isn't one.
+  """
+  base = os.environ.get('XDG_CACHE_HOME') or \
+    os.path.join(os.path.expanduser('~'), '.cache')
+  cache_dir = os.path.join(base, 'compression-test')
+  try:
+    os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+    dir_stat = os.stat(cache_dir)
+  except OSError:
+    return None
+  if hasattr(os, 'getuid') and (dir_stat.st_uid != os.getuid() or
+                                dir_stat.st_mode & 0o022):
+    return None
+  return cache_dir
+
+def save_trie(trie, cache_dir, cache_file):
+  "Write trie to cache_file, by way of a new file in cache_dir."
+  try:
+    fd, tmp_file = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+  except OSError:
+    return  # no cache, then
+  try:
+    with os.fdopen(fd, 'w', encoding='utf-8') as fh:
+      json.dump(trie, fh, separators=(',', ':'))
+    os.replace(tmp_file, cache_file)
+  except (IOError, OSError):
+    try:
+      os.unlink(tmp_file)
+    except OSError:
+      pass
+
+def _valid_node(node):
+  "Whether node is a trie node, as compile_trie() makes them."
+  if node is True or node is False:
+    return False
+  if node in (0, 1):
+    return True
+  if not isinstance(node, (list, tuple)) or len(node) != 2:
+    return False
+  negate, children = node
+  if negate is True or negate is False or negate not in (0, 1) or \
+     not isinstance(children, dict) or not children:
+    return False
+  return all(isinstance(label, str) and _valid_node(child)
+             for (label, child) in children.items())
+
+
+def compile_trie(lines):
+  """
+  Compile the rules of a public suffix list into a trie of reversed labels
+  (i.e., the TLD first). A node is 1 for an exception rule and 0 otherwise,
+  or if it has children, a (flag, {label: node}) tuple.
+  """
+  root = [0, {}]
+  for line in lines:
+    line = line.strip()
+    if not line or line.startswith('//'):
+      continue
+    rule = line.split()[0].lstrip('.')
+    negate = 0
+    if rule.startswith('!'):
+      negate = 1
+      rule = rule[1:]
+    node = root
+    for label in reversed(rule.split('.')):
+      node = node[1].setdefault(label, [0, {}])
+    node[0] = negate
+  return _freeze(root)
+
+def _freeze(node):
+  negate, children = node
+  if not children:
+    return negate
+  return (negate, dict((label, _freeze(child))
+                       for (label, child) in children.items()))
+
+
+def get_public_suffix(trie, domain):
+  """
+  Return the registrable part of domain; e.g., "example.co.uk" for
+  "www.example.co.uk". This follows the publicsuffix module.
+  """
+  parts = domain.lower().strip('.').split('.')
+  hits = [None] * len(parts)
+  _lookup(hits, 1, trie, parts)
+  for i, what in enumerate(hits):
+    if what == 0:
+      return '.'.join(parts[i:])
+
+def _lookup(hits, depth, node, parts):
+  if node in (0, 1):
+    negate, children = node, None
+  else:
+    negate, children = node
+  hits[-depth] = negate
+  if depth < len(parts) and children:
+    for label in ('*', parts[-depth]):
+      child = children.get(label)
+      if child is not None:
+        _lookup(hits, depth + 1, child, parts)